@@ -2,10 +2,13 @@ import os
 import sys
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from database import Database
+from database import Database, worker_id
 from analyzer import AIAnalyzer
 from notifier import Notifier
+from prefilter import load_filter, PREFILTER_LOGIC
 
 load_dotenv()
 
@@ -20,20 +23,31 @@ logging.basicConfig(
 logger = logging.getLogger("Analyzer")
 
 class RateLimiter:
-    """速率限制器"""
-    def __init__(self, requests_per_minute=15):
+    """速率限制器 (令牌桶, 线程安全)
+
+    每分钟补充 requests_per_minute 个令牌, 最多积攒 burst 个; 并发分析时
+    所有线程共用一个桶, 请求的发起速率仍不超过 AI_REQUESTS_PER_MINUTE。
+    """
+    def __init__(self, requests_per_minute=15, burst=1):
         self.rpm = requests_per_minute
         self.interval = 60.0 / requests_per_minute
-        self.last_request = 0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
     
     def wait(self):
         """等待直到可以发送下一个请求"""
-        elapsed = time.time() - self.last_request
-        if elapsed < self.interval:
-            wait_time = self.interval - elapsed
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+            self.updated = now
+            # 预订一个令牌; 不足时令牌数为负, 后来的线程按顺序排在更晚的时间
+            self.tokens -= 1
+            wait_time = -self.tokens * self.interval if self.tokens < 0 else 0
+        if wait_time > 0:
             logger.info(f"Rate limiting: waiting {wait_time:.2f}s...")
             time.sleep(wait_time)
-        self.last_request = time.time()
 
 def is_valid_post(pid, content, author, section_name):
     """验证帖子数据是否有效"""
@@ -74,6 +88,7 @@ def main():
     # 速率控制配置
     max_posts_per_run = int(os.getenv("MAX_POSTS_PER_RUN", "10"))
     requests_per_minute = int(os.getenv("AI_REQUESTS_PER_MINUTE", "10"))
+    concurrency = max(1, int(os.getenv("ANALYZE_CONCURRENCY", "1")))
     
     # 初始化
     db = Database()
@@ -83,10 +98,12 @@ def main():
         provider=ai_provider, 
         gemini_key=gemini_key, 
         gemini_model=gemini_model,
-        star_owner_name=star_owner_name
+        star_owner_name=star_owner_name,
+        cache=db
     )
     notifier = Notifier(ding_url, ding_secret)
     rate_limiter = RateLimiter(requests_per_minute=requests_per_minute)
+    prefilter = load_filter(db)
     
     # 获取未分析帖子数量
     total_unanalyzed = db.get_unanalyzed_count()
@@ -96,93 +113,181 @@ def main():
         logger.info("No posts to analyze. Exiting.")
         return 0
     
-    # 获取本次要分析的帖子(限制数量)
-    logger.info(f"DEBUG: Attempting to fetch max {max_posts_per_run} posts...")
-    unanalyzed = db.get_unanalyzed_posts(limit=max_posts_per_run)
-    logger.info(f"DEBUG: Fetched {len(unanalyzed)} posts for analysis.")
+    # 领取本次要分析的帖子(限制数量); 其他分析进程已领取的帖子会被跳过
+    owner = worker_id()
+    logger.info(f"DEBUG: Attempting to claim max {max_posts_per_run} posts as {owner}...")
+    unanalyzed = db.claim_posts(owner, limit=max_posts_per_run)
+    logger.info(f"DEBUG: Claimed {len(unanalyzed)} posts for analysis.")
     logger.info(f"Analyzing {len(unanalyzed)} posts (max: {max_posts_per_run})...")
+    try:
+        success_count, valuable_count = analyze_posts(db, analyzer, notifier, rate_limiter, unanalyzed, concurrency, prefilter)
+    finally:
+        # 分析失败的帖子释放租约, 下次运行重试
+        db.release_posts(owner)
+    
+    # 统计信息
+    remaining = total_unanalyzed - success_count
+    logger.info(f"Analysis complete. Processed: {success_count}/{len(unanalyzed)}, Valuable: {valuable_count}, Remaining: {remaining}")
+    if analyzer.cache is not None:
+        logger.info(f"Analysis cache: {analyzer.cache_hits} hits, {analyzer.cache_misses} misses")
+        db.evict_analysis_cache()
+
+    # 已分析的旧帖子移到归档表 (ARCHIVE_AFTER_DAYS)
+    db.archive_old_posts()
     
-    # 逐个分析
+    return 0
+
+def request_analysis(analyzer, rate_limiter, batch):
+    """在线程池中执行: 分析一组帖子 (AI_BATCH_TOKEN_BUDGET 未启用时每组一个), 返回 {pid: 分析结果或 None}
+
+    每个请求发起前等待令牌。
+    """
+    logger.info(f"  Sending {len(batch)} post(s) to AI analyzer: {', '.join(pid for pid, _ in batch)}")
+    return analyzer.analyze_batch(batch, wait=rate_limiter.wait)
+
+def analyze_posts(db, analyzer, notifier, rate_limiter, unanalyzed, concurrency=1, prefilter=None):
+    """分析已领取的帖子, 返回 (成功数, 有价值数)
+
+    最多 concurrency 个 AI 请求同时进行, 发起速率由 rate_limiter 控制;
+    结果按领取顺序在当前线程写库和发送通知, 与逐个分析时的顺序一致。
+    """
     success_count = 0
     valuable_count = 0
     
-    for idx, (pid, content, url, author, create_time, section_name) in enumerate(unanalyzed, 1):
-        logger.info(f"[{idx}/{len(unanalyzed)}] Processing post {pid}...")
-        
-        # 数据验证
-        if not is_valid_post(pid, content, author, section_name):
-            logger.info(f"  ⊘ Skipped invalid post {pid}")
-            # 标记为已分析（避免重复处理）
-            db.update_analysis(pid, "无效数据", "跳过", "数据验证失败", "此帖子数据无效，已跳过分析")
+    # 数据验证
+    valid = [
+        (pid, content) for pid, content, url, author, create_time, section_name in unanalyzed
+        if is_valid_post(pid, content, author, section_name)
+    ]
+    
+    # 近似重复 (SimHash) 的帖子沿用已分析帖子的结果, 本地预筛选判定为无关的帖子直接标记为无价值,
+    # 都不再请求 AI
+    reused = {}
+    filtered = {}
+    for pid, content in valid:
+        duplicate = db.find_near_duplicate(pid, content)
+        if duplicate:
+            reused[pid] = duplicate
             continue
+        if prefilter is not None:
+            candidate, reason = prefilter.is_candidate(content)
+            if not candidate:
+                filtered[pid] = reason
+    
+    # 同一批中互为近似重复的帖子只请求一次 AI (每组第一个), 其余沿用它的结果
+    pending = [post for post in valid if post[0] not in reused and post[0] not in filtered]
+    copies = db.group_near_duplicates(pending)
+    analyses = {}
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        for batch in analyzer.plan_batches([post for post in pending if post[0] not in copies]):
+            future = executor.submit(request_analysis, analyzer, rate_limiter, batch)
+            futures.update((pid, future) for pid, _ in batch)
         
-        logger.info(f"  ✓ Post validation passed")
-        logger.info(f"  Post ID: {pid}")
-        logger.info(f"  Author: {author}")
-        logger.info(f"  Section: {section_name}")
-        logger.info(f"  URL: {url}")
-        logger.info(f"  Content length: {len(content)} chars")
-        
-        # Log content preview
-        content_preview = content[:300] + "..." if len(content) > 300 else content
-        logger.debug(f"  Content preview: {content_preview}")
-        
-        try:
-            # 速率限制
-            rate_limiter.wait()
+        for idx, (pid, content, url, author, create_time, section_name) in enumerate(unanalyzed, 1):
+            logger.info(f"[{idx}/{len(unanalyzed)}] Processing post {pid}...")
             
-            # AI分析
-            logger.info(f"  Sending to AI analyzer...")
-            analysis = analyzer.analyze_post(content)
+            duplicate = reused.get(pid)
+            if duplicate:
+                # 原帖分析时已经通知过, 重复的帖子不再通知
+                logger.info(f"  ↺ Near-duplicate of analyzed post {duplicate['post_id']} (distance {duplicate['distance']}), reusing its analysis")
+                db.update_analysis(pid, duplicate['ticker'], duplicate['suggestion'], duplicate['logic'], duplicate['ai_summary'],
+                                   is_valuable=duplicate['is_valuable'])
+                success_count += 1
+                continue
             
-            if analysis:
-                logger.info(f"  ✓ Analysis successful!")
-                logger.info(f"    - is_valuable: {analysis.get('is_valuable')}")
-                logger.info(f"    - ticker: {analysis.get('ticker', '无')}")
-                logger.info(f"    - suggestion: {analysis.get('suggestion', '无')}")
-                logger.info(f"    - logic: {analysis.get('logic', '无')[:100]}..." if len(analysis.get('logic', '')) > 100 else f"    - logic: {analysis.get('logic', '无')}")
-                logger.info(f"    - ai_summary: {analysis.get('ai_summary', '无')}")
-                
-                # 更新数据库
+            if pid in copies:
+                analysis = analyses.get(copies[pid])
+                if not analysis:
+                    logger.warning(f"  ✗ Near-duplicate {copies[pid]} in this batch was not analyzed, retrying {pid} next run")
+                    continue
+                # 代表帖子有价值时已经通知过, 重复的帖子不再通知
+                logger.info(f"  ↺ Near-duplicate of post {copies[pid]} in this batch, reusing its analysis")
                 db.update_analysis(
                     pid,
                     analysis.get('ticker', '无'),
                     analysis.get('suggestion', '无'),
                     analysis.get('logic', '无'),
-                    analysis.get('ai_summary', '无')
+                    analysis.get('ai_summary', '无'),
+                    is_valuable=analysis.get('is_valuable')
                 )
                 success_count += 1
-                logger.info(f"  ✓ Database updated for post {pid}")
+                continue
+            
+            if pid in filtered:
+                logger.info(f"  ⊘ Prefilter: post {pid} is not investment-related ({filtered[pid]})")
+                db.update_analysis(pid, "无", "无", PREFILTER_LOGIC, "本地预筛选判定为非投资内容, 未经 AI 分析", is_valuable=False)
+                continue
+            
+            future = futures.get(pid)
+            if future is None:
+                logger.info(f"  ⊘ Skipped invalid post {pid}")
+                # 标记为已分析（避免重复处理）
+                db.update_analysis(pid, "无效数据", "跳过", "数据验证失败", "此帖子数据无效，已跳过分析")
+                continue
+            
+            logger.info(f"  ✓ Post validation passed")
+            logger.info(f"  Post ID: {pid}")
+            logger.info(f"  Author: {author}")
+            logger.info(f"  Section: {section_name}")
+            logger.info(f"  URL: {url}")
+            logger.info(f"  Content length: {len(content)} chars")
+            
+            # Log content preview
+            content_preview = content[:300] + "..." if len(content) > 300 else content
+            logger.debug(f"  Content preview: {content_preview}")
+            
+            try:
+                # AI分析 (已在线程池中发起)
+                analysis = future.result().get(pid)
+                analyses[pid] = analysis
                 
-                # 发送通知(如果有价值)
-                if analysis.get('is_valuable'):
-                    valuable_count += 1
-                    logger.info(f"  📢 Valuable info found! Sending DingTalk notification...")
-                    notifier.notify_investment_report(
-                        url,
-                        analysis.get('ticker'),
-                        analysis.get('suggestion'),
-                        analysis.get('logic'),
-                        analysis.get('ai_summary'),
-                        author=author,
-                        create_time=create_time,
-                        section_name=section_name
+                if analysis:
+                    logger.info(f"  ✓ Analysis successful!")
+                    logger.info(f"    - is_valuable: {analysis.get('is_valuable')}")
+                    logger.info(f"    - ticker: {analysis.get('ticker', '无')}")
+                    logger.info(f"    - suggestion: {analysis.get('suggestion', '无')}")
+                    logger.info(f"    - logic: {analysis.get('logic', '无')[:100]}..." if len(analysis.get('logic', '')) > 100 else f"    - logic: {analysis.get('logic', '无')}")
+                    logger.info(f"    - ai_summary: {analysis.get('ai_summary', '无')}")
+                    
+                    # 更新数据库
+                    db.update_analysis(
+                        pid,
+                        analysis.get('ticker', '无'),
+                        analysis.get('suggestion', '无'),
+                        analysis.get('logic', '无'),
+                        analysis.get('ai_summary', '无'),
+                        is_valuable=analysis.get('is_valuable')
                     )
-                    logger.info(f"  ✓ Notification sent")
+                    success_count += 1
+                    logger.info(f"  ✓ Database updated for post {pid}")
+                    
+                    # 发送通知(如果有价值)
+                    if analysis.get('is_valuable'):
+                        valuable_count += 1
+                        logger.info(f"  📢 Valuable info found! Sending DingTalk notification...")
+                        notifier.notify_investment_report(
+                            url,
+                            analysis.get('ticker'),
+                            analysis.get('suggestion'),
+                            analysis.get('logic'),
+                            analysis.get('ai_summary'),
+                            author=author,
+                            create_time=create_time,
+                            section_name=section_name
+                        )
+                        logger.info(f"  ✓ Notification sent")
+                    else:
+                        logger.info(f"  ℹ Post {pid} analyzed but not valuable (no notification sent)")
                 else:
-                    logger.info(f"  ℹ Post {pid} analyzed but not valuable (no notification sent)")
-            else:
-                logger.warning(f"  ✗ Failed to analyze post {pid} - analyzer returned None")
-                
-        except Exception as e:
-            logger.error(f"Error analyzing post {pid}: {e}")
-            continue
-    
-    # 统计信息
-    remaining = total_unanalyzed - success_count
-    logger.info(f"Analysis complete. Processed: {success_count}/{len(unanalyzed)}, Valuable: {valuable_count}, Remaining: {remaining}")
+                    logger.warning(f"  ✗ Failed to analyze post {pid} - analyzer returned None")
+                    
+            except Exception as e:
+                logger.error(f"Error analyzing post {pid}: {e}")
+                continue
     
-    return 0
+    return success_count, valuable_count
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -5,12 +5,26 @@ import re
 import os
 import time
 import socket
+import hashlib
+import threading
 
 logger = logging.getLogger(__name__)
 
+# 批量分析时每个请求最多包含的帖子数
+BATCH_MAX_POSTS = 10
+ANALYSIS_FIELDS = ('ticker', 'suggestion', 'logic', 'ai_summary')
+_CJK_RE = re.compile(r'[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]')
+
+def estimate_tokens(text):
+    """粗略估计 token 数: 汉字约 1 个/字, 其他字符约 4 个字符 1 个"""
+    text = text or ''
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
 class AIAnalyzer:
-    def __init__(self, api_key=None, base_url="https://api.deepseek.com", provider="openai", gemini_key=None, gemini_model="gemini-2.0-flash", star_owner_name=None):
+    def __init__(self, api_key=None, base_url="https://api.deepseek.com", provider="openai", gemini_key=None, gemini_model="gemini-2.0-flash", star_owner_name=None, cache=None):
         self.provider = provider
+        self.model = gemini_model if provider == "gemini" else "deepseek-chat"
         self.star_owner_name = star_owner_name
         self.system_prompt = f"""
 You are a senior financial analyst. Analyze the following ZSXQ post content (including comments) to extract investment intelligence.
@@ -40,6 +54,24 @@ Output JSON format:
   "ai_summary": "一句话核心总结 (中文)"
 }}
 """
+        self.batch_prompt = self.system_prompt + """
+Batch Mode:
+The user message contains several independent posts, each starting with a line "=== POST <id> ===".
+Analyze every post separately with the rules above (never mix information between posts).
+Output a JSON object {"results": [...]} whose array has exactly one element per post, each with
+the fields above plus "id" (the post id exactly as given).
+"""
+        # 批量分析的 token 预算, 0 表示不启用 (每个帖子单独请求)
+        self.batch_token_budget = int(os.getenv("AI_BATCH_TOKEN_BUDGET", "0"))
+
+        # 分析结果缓存 (Database 的 analysis_cache 表), prompt 修改后 prompt_hash 变化, 旧缓存自然失效;
+        # 批量请求的结果用批量 prompt 的 hash, 与单独请求的结果分开缓存
+        self.cache = cache if os.getenv("ANALYSIS_CACHE", "true").lower() == "true" else None
+        self.prompt_hash = hashlib.sha256(self.system_prompt.encode('utf-8')).hexdigest()[:16]
+        self.batch_prompt_hash = hashlib.sha256(self.batch_prompt.encode('utf-8')).hexdigest()[:16]
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache_lock = threading.Lock()
 
         # Network connectivity check
         self._check_network_connectivity()
@@ -62,11 +94,138 @@ Output JSON format:
             logger.info(f"OpenAI/DeepSeek client initialized with base_url: {base_url}")
 
     def analyze_post(self, content):
+        return self.analyze_post_cached(content)[0]
+
+    def analyze_post_cached(self, content):
+        """返回 (分析结果, 是否来自缓存); 来自缓存时调用方不需要为速率限制等待"""
+        key = self.cache_key(content)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached, True
+        result = self._request_post(content)
+        self._cache_put(key, result)
+        return result, False
+
+    def _request_post(self, content):
         if self.provider == "gemini":
             return self._analyze_with_gemini(content)
         else:
             return self._analyze_with_openai(content)
 
+    def cache_key(self, content, batch=False):
+        """内容 (空白归一化后) + provider + model + prompt hash (batch 为 True 时用批量 prompt 的)"""
+        normalized = re.sub(r'\s+', ' ', content or '').strip()
+        prompt_hash = self.batch_prompt_hash if batch else self.prompt_hash
+        key = f"{self.provider}\n{self.model}\n{prompt_hash}\n{normalized}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _cache_get(self, key):
+        if self.cache is None:
+            return None
+        try:
+            result = self.cache.get_cached_analysis(key)
+        except Exception as e:
+            logger.warning(f"Analysis cache lookup failed: {e}")
+            result = None
+        with self._cache_lock:
+            if result is not None:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        return result
+
+    def _cache_put(self, key, result, batch=False):
+        if self.cache is None or not result:
+            return
+        prompt_hash = self.batch_prompt_hash if batch else self.prompt_hash
+        try:
+            self.cache.save_cached_analysis(key, self.provider, self.model, prompt_hash, result)
+        except Exception as e:
+            logger.warning(f"Failed to cache analysis result: {e}")
+
+    def plan_batches(self, posts):
+        """把 [(post_id, content)] 按 token 预算分组; 较长的帖子 (超过预算一半) 单独一组"""
+        if self.batch_token_budget <= 0:
+            return [[post] for post in posts]
+        batches = []
+        current, used = [], 0
+        for post in posts:
+            tokens = estimate_tokens(post[1])
+            if tokens > self.batch_token_budget // 2:
+                batches.append([post])
+                continue
+            if current and (used + tokens > self.batch_token_budget or len(current) >= BATCH_MAX_POSTS):
+                batches.append(current)
+                current, used = [], 0
+            current.append(post)
+            used += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def analyze_batch(self, posts, wait=None):
+        """一个请求分析多个帖子, 返回 {post_id: 分析结果或 None}
+
+        命中缓存的帖子不再请求 (多个帖子时查批量 prompt 的缓存)。返回的 JSON 数组逐个校验, 缺失或格式不对的帖子
+        (以及整个响应无法解析时的全部帖子) 退回单独请求。wait 在每次请求前调用 (速率限制)。
+        """
+        wait = wait or (lambda: None)
+        results = {}
+        batch = len(posts) > 1
+        keys = {pid: self.cache_key(content, batch=batch) for pid, content in posts}
+        misses = []
+        for pid, content in posts:
+            cached = self._cache_get(keys[pid])
+            if cached is not None:
+                results[pid] = cached
+            else:
+                misses.append((pid, content))
+
+        if len(misses) > 1:
+            wait()
+            packed = "\n\n".join(f"=== POST {pid} ===\n{content}" for pid, content in misses)
+            if self.provider == "gemini":
+                response = self._analyze_with_gemini(packed, system_prompt=self.batch_prompt)
+            else:
+                response = self._analyze_with_openai(packed, system_prompt=self.batch_prompt)
+            answered = self._parse_batch(response, [pid for pid, _ in misses])
+            logger.info(f"Batch analysis: {len(answered)}/{len(misses)} posts answered in one request")
+            for pid, result in answered.items():
+                self._cache_put(keys[pid], result, batch=True)
+            results.update(answered)
+
+        for pid, content in misses:
+            if pid not in results:
+                wait()
+                results[pid] = self._request_post(content)
+                self._cache_put(self.cache_key(content), results[pid])
+        return results
+
+    @staticmethod
+    def _parse_batch(response, post_ids):
+        """校验批量响应, 返回 {post_id: 分析结果}, 只包含格式正确的元素"""
+        if isinstance(response, dict):
+            response = response.get('results')
+        if not isinstance(response, list):
+            logger.warning("Batch analysis returned malformed JSON, falling back to per-post analysis")
+            return {}
+        expected = {str(pid): pid for pid in post_ids}
+        results = {}
+        duplicates = set()
+        for item in response:
+            if not isinstance(item, dict) or str(item.get('id')) not in expected:
+                continue
+            if not isinstance(item.get('is_valuable'), bool):
+                continue
+            if any(not isinstance(item.get(field), str) for field in ANALYSIS_FIELDS):
+                continue
+            pid = expected[str(item['id'])]
+            if pid in results:
+                duplicates.add(pid)
+            results[pid] = {key: value for key, value in item.items() if key != 'id'}
+        # 同一个 id 出现多次时无法判断哪个正确, 都不采用
+        return {pid: item for pid, item in results.items() if pid not in duplicates}
+
     def _check_network_connectivity(self):
         """Check network connectivity to Google APIs"""
         try:
@@ -76,7 +235,7 @@ Output JSON format:
             logger.error(f"✗ Network connectivity check failed: {e}")
             logger.error("Cannot reach generativelanguage.googleapis.com - check your internet connection")
     
-    def _analyze_with_gemini(self, content):
+    def _analyze_with_gemini(self, content, system_prompt=None):
         max_retries = 10
         import random
         base_wait_time = 30  # Start with 30 seconds
@@ -94,7 +253,7 @@ Output JSON format:
                     model=self.gemini_model,
                     contents=content,
                     config=self.types.GenerateContentConfig(
-                        system_instruction=self.system_prompt,
+                        system_instruction=system_prompt or self.system_prompt,
                         response_mime_type="application/json"
                     )
                 )
@@ -107,7 +266,8 @@ Output JSON format:
                 logger.debug(f"Response text (preview): {text[:200]}..." if len(text) > 200 else f"Response text: {text}")
                 
                 result = json.loads(text)
-                logger.info(f"✓ Successfully parsed JSON response: is_valuable={result.get('is_valuable')}, ticker={result.get('ticker')}")
+                if isinstance(result, dict) and 'results' not in result:
+                    logger.info(f"✓ Successfully parsed JSON response: is_valuable={result.get('is_valuable')}, ticker={result.get('ticker')}")
                 return result
                 
             except json.JSONDecodeError as e:
@@ -137,12 +297,12 @@ Output JSON format:
                     logger.error(f"✗ Gemini analysis failed: {e}")
                     return None
 
-    def _analyze_with_openai(self, content):
+    def _analyze_with_openai(self, content, system_prompt=None):
         try:
             response = self.client.chat.completions.create(
-                model="deepseek-chat", # 或者 gpt-4, gpt-3.5-turbo 等
+                model=self.model, # deepseek-chat, 或者 gpt-4, gpt-3.5-turbo 等
                 messages=[
-                    {"role": "system", "content": self.system_prompt},
+                    {"role": "system", "content": system_prompt or self.system_prompt},
                     {"role": "user", "content": content},
                 ],
                 response_format={ 'type': 'json_object' }
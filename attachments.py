@@ -0,0 +1,121 @@
+import os
+import re
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class AttachmentDownloader:
+    """
+    Streams shared files (PDFs, research reports) to disk.
+
+    - Download URLs are resolved through the zsxq API, then fetched in CHUNK_SIZE
+      chunks so memory stays flat regardless of file size.
+    - Partial downloads are kept as <name>.part and resumed with an HTTP Range request.
+    - The SHA-256 is computed while streaming; files already downloaded (same file_id)
+      are skipped, and a file whose content matches a stored SHA-256 is discarded in
+      favour of the existing copy.
+    """
+
+    def __init__(self, crawler, db, download_dir=None, workers=None):
+        self.crawler = crawler
+        self.db = db
+        self.download_dir = download_dir or os.getenv("ZSXQ_ATTACHMENT_DIR", "attachments")
+        self.workers = workers or int(os.getenv("ZSXQ_ATTACHMENT_WORKERS", "3"))
+
+    @staticmethod
+    def _safe_name(name):
+        return re.sub(r'[\\/:*?"<>|\s]+', '_', name or 'file').strip('_') or 'file'
+
+    def _target_path(self, group_id, file_id, name):
+        directory = os.path.join(self.download_dir, str(group_id))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{file_id}_{self._safe_name(name)}")
+
+    @staticmethod
+    def _hash_existing(path, digest):
+        """把已下载的部分喂给 digest, 续传时保持 SHA-256 完整"""
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    def _stream_to_disk(self, url, part_path):
+        """下载到 .part 文件 (支持断点续传), 返回 (size, sha256)"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        digest = hashlib.sha256()
+        with self.crawler.open_download(url, offset=offset) as resp:
+            if offset and resp.status_code == 206:
+                self._hash_existing(part_path, digest)
+                mode = 'ab'
+                logger.info(f"Resuming {os.path.basename(part_path)} from {offset} bytes")
+            elif offset and resp.status_code == 416:
+                # 服务器认为已经下载完整
+                self._hash_existing(part_path, digest)
+                return offset, digest.hexdigest()
+            else:
+                resp.raise_for_status()
+                offset = 0
+                mode = 'wb'
+
+            size = offset
+            with open(part_path, mode) as f:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+        return size, digest.hexdigest()
+
+    def download(self, post):
+        """下载单个文件, 返回 'downloaded' / 'skipped' / 'duplicate' / 'failed'"""
+        file_id = post.get('file_id')
+        if file_id is None:
+            return 'skipped'
+        group_id = post.get('group_id')
+        name = post.get('file_name')
+
+        existing = self.db.get_attachment(file_id=file_id)
+        if existing and existing['sha256']:
+            return 'skipped'
+
+        try:
+            url = self.crawler.get_file_download_url(file_id)
+            if not url:
+                logger.warning(f"No download URL for file {file_id} ({name})")
+                return 'failed'
+
+            path = self._target_path(group_id, file_id, name)
+            part_path = path + '.part'
+            size, sha256 = self._stream_to_disk(url, part_path)
+
+            duplicate = self.db.get_attachment(sha256=sha256)
+            if duplicate and duplicate['path'] and os.path.exists(duplicate['path']):
+                os.remove(part_path)
+                self.db.save_attachment(file_id, group_id, name, size, sha256, duplicate['path'])
+                logger.info(f"File {name} is identical to {duplicate['name']}, reusing {duplicate['path']}")
+                return 'duplicate'
+
+            os.replace(part_path, path)
+            self.db.save_attachment(file_id, group_id, name, size, sha256, path)
+            logger.info(f"Downloaded {name} ({size / 1024 / 1024:.1f} MB) -> {path}")
+            return 'downloaded'
+        except Exception as e:
+            # .part 文件保留, 下次运行从断点续传
+            logger.error(f"Error downloading file {file_id} ({name}): {e}")
+            return 'failed'
+
+    def download_all(self, posts):
+        """并行下载 posts 中的文件附件, 返回各结果的计数"""
+        files = [post for post in posts if post.get('file_id') is not None]
+        counts = {'downloaded': 0, 'skipped': 0, 'duplicate': 0, 'failed': 0}
+        if not files:
+            return counts
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            for result in executor.map(self.download, files):
+                counts[result] += 1
+        logger.info(f"Attachments: {counts}")
+        return counts
@@ -1,11 +1,13 @@
 import os
+import sys
 import logging
 from dotenv import load_dotenv
 from typing import List, Dict
 
 from crawler import ZsxqCrawler
 from database import Database
-from crawl import fetch_all_data
+from notifier import Notifier
+from crawl import PACER_STATE_KEY
 
 # Load environment variables
 load_dotenv()
@@ -14,11 +16,129 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def backfill_data(group_id: str):
+PAGE_SIZE = 20
+
+
+class BackfillEngine:
+    """
+    Pages through the full history of each section with the end_time cursor.
+
+    After every page the posts and the next cursor are written to the DB in one
+    transaction, so an interrupted run (crash, Actions timeout, exhausted budget)
+    resumes exactly where it stopped. Each API page costs one request from the
+    per-run budget.
+    """
+
+    def __init__(self, db: Database, crawler: ZsxqCrawler, group_id: str, request_budget: int = 200):
+        self.db = db
+        self.crawler = crawler
+        self.group_id = group_id
+        self.request_budget = request_budget
+        self.requests_used = 0
+        self.counts = {'new': 0, 'changed': 0, 'pending': 0, 'unchanged': 0}
+
+    def discover_sections(self) -> List[Dict]:
+        """
+        Sections to backfill. Columns come first so that posts get their most
+        specific section_name when they are first inserted.
+        """
+        sections = []
+        self.requests_used += 1
+        for col in self.crawler.get_group_columns(self.group_id):
+            col_id = col.get('column_id')
+            sections.append({
+                'key': f"column:{col_id}",
+                'fetch': lambda end_time, col_id=col_id, name=col.get('name'):
+                    self.crawler.get_column_articles(self.group_id, col_id, name, end_time=end_time)
+            })
+        sections.append({
+            'key': 'digests',
+            'fetch': lambda end_time: self.crawler.get_group_topics(self.group_id, 'digests', end_time=end_time)
+        })
+        sections.append({
+            'key': 'q_and_a',
+            'fetch': lambda end_time: self.crawler.get_group_questions(self.group_id, end_time=end_time)
+        })
+        sections.append({
+            'key': 'all',
+            'fetch': lambda end_time: self.crawler.get_group_topics(self.group_id, 'all', end_time=end_time)
+        })
+
+        only = os.getenv("BACKFILL_SECTIONS")
+        if only:
+            wanted = {key.strip() for key in only.split(',') if key.strip()}
+            sections = [section for section in sections if section['key'] in wanted]
+        return sections
+
+    def backfill_section(self, section: Dict) -> bool:
+        """Backfill one section until it is exhausted or the budget runs out. Returns True when done."""
+        key = section['key']
+        checkpoint = self.db.get_backfill_checkpoint(self.group_id, key) or {
+            'next_cursor': None, 'pages': 0, 'items': 0, 'done': False
+        }
+        if checkpoint['done']:
+            logger.info(f"[{key}] already fully backfilled ({checkpoint['items']} items), skipping")
+            return True
+        if checkpoint['pages']:
+            logger.info(f"[{key}] resuming from page {checkpoint['pages'] + 1} (cursor {checkpoint['next_cursor']})")
+
+        while self.requests_used < self.request_budget:
+            end_time = checkpoint['next_cursor'] or self.crawler.latest_cursor()
+            self.requests_used += 1
+            posts = section['fetch'](end_time)
+            if posts is None:
+                logger.warning(f"[{key}] request failed at cursor {end_time}, will resume here next run")
+                return False
+
+            oldest = min((post['create_time'] for post in posts if post.get('create_time')), default=None)
+            checkpoint = {
+                'next_cursor': self.crawler.previous_cursor(oldest) if oldest else end_time,
+                'pages': checkpoint['pages'] + 1,
+                'items': checkpoint['items'] + len(posts),
+                'done': len(posts) < PAGE_SIZE or oldest is None
+            }
+            counts = self.db.save_backfill_page(self.group_id, key, posts, checkpoint)
+            for name, value in counts.items():
+                self.counts[name] += value
+            logger.info(f"[{key}] page {checkpoint['pages']}: {len(posts)} items "
+                        f"({counts['new']} new, {counts['changed']} changed, {counts['pending']} pending threads, "
+                        f"{counts['unchanged']} unchanged)")
+
+            if checkpoint['done']:
+                logger.info(f"[{key}] reached the beginning of history ({checkpoint['items']} items)")
+                return True
+
+        logger.info(f"[{key}] request budget exhausted, will resume next run")
+        return False
+
+    def run(self) -> bool:
+        """Returns True when every section has been fully backfilled."""
+        complete = True
+        for section in self.discover_sections():
+            if self.requests_used >= self.request_budget:
+                complete = False
+                break
+            complete = self.backfill_section(section) and complete
+
+        logger.info(f"Backfill run finished. Requests used: {self.requests_used}/{self.request_budget}, "
+                    f"new posts: {self.counts['new']}, changed posts: {self.counts['changed']}, "
+                    f"pending threads: {self.counts['pending']}, "
+                    f"unchanged posts: {self.counts['unchanged']}, "
+                    f"{'all sections complete' if complete else 'incomplete, re-run to continue'}")
+        return complete
+
+
+def backfill_data(group_id: str, crawler: ZsxqCrawler = None):
     """
-    Backfill data by re-crawling and resolving comments.
-    Existing posts will be updated with new content (including comments) 
-    and their analyzed status will be reset.
+    Backfill a group's full history, including comments.
+    Existing posts are updated with new content (including comments); only posts
+    whose content hash changed have their analyzed status reset. Listing pages only
+    embed the first few comments, so posts with truncated threads never overwrite
+    stored content: they are marked thread_pending and crawl.py fetches the full
+    thread in a later cycle.
+
+    Progress is checkpointed per section; set BACKFILL_RESTART=true to start over
+    and BACKFILL_REQUEST_BUDGET to limit the number of API pages per run.
     """
     cookie = os.getenv('ZSXQ_COOKIE')
     if not cookie:
@@ -26,89 +146,56 @@ def backfill_data(group_id: str):
         return
 
     logger.info("Starting backfill process...")
-    
+
     # Initialize components
     db = Database()
-    crawler = ZsxqCrawler(cookie)
-    
-    # Fetch all data (now includes comments via updated Crawler)
+    # 调用方传入的 crawler 由调用方关闭
+    own_crawler = crawler is None
+    crawler = crawler or ZsxqCrawler(cookie)
+    crawler.pacer.load_state(db.get_state(PACER_STATE_KEY))
+    request_budget = int(os.getenv("BACKFILL_REQUEST_BUDGET") or "200")
+
+    if os.getenv("BACKFILL_RESTART", "false").lower() == "true":
+        logger.info("BACKFILL_RESTART is set, clearing checkpoints")
+        db.reset_backfill_checkpoints(group_id)
+
     try:
-        fetched_data = fetch_all_data(crawler, group_id)
-        if not fetched_data:
-            logger.warning("No data fetched.")
-            return
+        BackfillEngine(db, crawler, group_id, request_budget=request_budget).run()
     except Exception as e:
-        logger.error(f"Error fetching data: {e}")
-        return
-
-    logger.info(f"Fetched {len(fetched_data)} items. Processing updates...")
-    
-    updated_count = 0
-    new_count = 0 
-    
-    for post in fetched_data:
-        post_id = post['id']
-        content = post['content']
-        
-        if db.post_exists(post_id):
-            # Update existing post
-            logger.info(f"Updating post {post_id} with new content (comments included)...")
-            success = db.update_post_content(post_id, content)
-            if success:
-                updated_count += 1
-        else:
-            # Save new post
-            logger.info(f"Saving new post {post_id}...")
-            success = db.save_post(
-                post_id, 
-                content, 
-                post['author'], 
-                post['create_time'], 
-                post['url'],
-                post.get('section_name')
-            )
-            if success:
-                new_count += 1
-    
-    logger.info("Backfill complete.")
-    logger.info(f"Total processed: {len(fetched_data)}")
-    logger.info(f"Updated posts: {updated_count}")
-    logger.info(f"New posts added: {new_count}")
+        logger.error(f"Error during backfill: {e}", exc_info=True)
+    finally:
+        crawler.log_latency_stats()
+        db.set_state(PACER_STATE_KEY, crawler.pacer.state())
+        if own_crawler:
+            crawler.close()
+        db.close()
 
 if __name__ == "__main__":
     # 初始化
     cookie = os.getenv('ZSXQ_COOKIE')
     ding_url = os.getenv("DINGTALK_WEBHOOK")
     ding_secret = os.getenv("DINGTALK_SECRET")
-    
+
     if not cookie:
         logger.error("ZSXQ_COOKIE not found in .env")
         sys.exit(1)
-    
+
     notifier = Notifier(ding_url, ding_secret)
     crawler = ZsxqCrawler(cookie, notifier)
-    
-    # 动态获取 group_id (使用与 crawl.py 相同的逻辑)
+
+    # 动态获取 group_id (使用与 crawl.py 相同的逻辑, 支持多个星球)
     try:
-        group_id = os.getenv("ZSXQ_GROUP_ID")
-        if not group_id:
-            group_url = os.getenv("ZSXQ_GROUP_URL")
-            if group_url:
-                group_id = ZsxqCrawler.extract_group_id_from_url(group_url)
-        
-        if not group_id:
-            logger.info("未配置 group_id，尝试自动获取...")
-            groups = crawler.get_user_groups()
-            if groups:
-                group_id = groups[0]['group_id']
-                logger.info(f"自动选择第一个星球: {groups[0]['name']} (ID: {group_id})")
-        
-        if not group_id:
-            logger.error("无法获取 group_id，请配置 ZSXQ_GROUP_ID 或 ZSXQ_GROUP_URL")
+        group_ids = crawler.resolve_group_ids()
+        if not group_ids:
+            logger.error("无法获取 group_id，请配置 ZSXQ_GROUP_ID / ZSXQ_GROUP_IDS 或 ZSXQ_GROUP_URL")
             sys.exit(1)
-            
-        backfill_data(group_id)
+
+        for group_id in group_ids:
+            logger.info(f"Backfilling group {group_id}...")
+            backfill_data(group_id, crawler)
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
         sys.exit(1)
-
+    finally:
+        # 保存 ZSXQ_RECORD_FILE 录制的响应并关闭连接池
+        crawler.close()
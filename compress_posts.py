@@ -0,0 +1,55 @@
+import os
+import sys
+import sqlite3
+import logging
+import argparse
+from dotenv import load_dotenv
+
+from database import Database
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压缩 SQLite 中已有帖子的 content (需设置 DB_COMPRESS_CONTENT=zlib 或 zstd)")
+    parser.add_argument("--no-train", action="store_true", help="不重新训练字典, 使用最近一次训练的字典")
+    parser.add_argument("--sample-size", type=int, default=2000, help="训练字典使用的帖子数 (默认 2000)")
+    parser.add_argument("--batch-size", type=int, default=500, help="每个事务压缩的帖子数 (默认 500)")
+    parser.add_argument("--vacuum", action="store_true", help="压缩后执行 VACUUM 回收文件空间")
+    args = parser.parse_args()
+
+    db = Database()
+    if db.use_postgres:
+        logger.info("PostgreSQL compresses large values itself (TOAST), nothing to do.")
+        return
+    if not db.codec.enabled:
+        logger.error("Set DB_COMPRESS_CONTENT=zlib (or zstd) to enable content compression.")
+        sys.exit(1)
+
+    if not args.no_train:
+        db.train_compression_dict(sample_size=args.sample_size)
+
+    count, raw_bytes, packed_bytes = db.compress_existing_posts(batch_size=args.batch_size)
+    if count:
+        logger.info(f"Compressed {count} posts: {raw_bytes / 1024 / 1024:.1f} MB -> "
+                    f"{packed_bytes / 1024 / 1024:.1f} MB ({packed_bytes / raw_bytes:.0%})")
+    else:
+        logger.info("No uncompressed posts above DB_COMPRESS_MIN_BYTES.")
+
+    if args.vacuum:
+        size_before = os.path.getsize(db.db_path)
+        db.close()
+        conn = sqlite3.connect(db.db_path)
+        conn.execute("VACUUM")
+        conn.close()
+        # VACUUM 可能改变 rowid, 全文索引按 rowid 关联, 需要重建
+        db = Database()
+        db.rebuild_search_index()
+        logger.info(f"VACUUM: {size_before / 1024 / 1024:.1f} MB -> {os.path.getsize(db.db_path) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
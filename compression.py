@@ -0,0 +1,116 @@
+import zlib
+import logging
+from collections import Counter
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DICT_SIZE = 32 * 1024
+
+
+def train_dictionary(codec, samples, size=DICT_SIZE):
+    """用样本帖子训练共享字典
+
+    - zstd: zstandard.train_dictionary
+    - zlib: zlib 的预置字典 (zdict) 只是一段前缀文本, 取样本中反复出现的行
+      (评论分隔符、常见作者名、固定格式) 拼接, 出现越多的越靠后 (距离越近, 编码越短)
+    """
+    samples = [sample.encode('utf-8') for sample in samples if sample]
+    if not samples:
+        return None
+    if codec == 'zstd':
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    counts = Counter()
+    for sample in samples:
+        for line in set(sample.splitlines()):
+            if 4 <= len(line) <= 200:
+                counts[line] += 1
+    common = [line for line, count in counts.most_common() if count > 1]
+    chosen = []
+    total = 0
+    for line in common:
+        if total + len(line) + 1 > size:
+            break
+        chosen.append(line)
+        total += len(line) + 1
+    return b'\n'.join(reversed(chosen)) or None
+
+
+class ContentCodec:
+    """
+    Transparent compression of investment_posts.content.
+
+    Compressed rows store NULL in content and the payload in content_z, with
+    content_codec naming the algorithm and the shared dictionary used
+    ('zlib', 'zlib:3', 'zstd:4'). Dictionaries live in the compression_dicts
+    table and are loaded on first use through load_dict(dict_id).
+    """
+
+    def __init__(self, codec=None, min_bytes=1024, load_dict=None):
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("DB_COMPRESS_CONTENT=zstd but the zstandard package is not installed. Falling back to zlib.")
+            codec = 'zlib'
+        self.codec = codec if codec in ('zlib', 'zstd') else None
+        self.min_bytes = min_bytes
+        self.load_dict = load_dict
+        self.dict_id = None
+        self._dicts = {}
+
+    @property
+    def enabled(self):
+        return self.codec is not None
+
+    def _dict(self, dict_id):
+        if dict_id is None:
+            return None
+        if dict_id not in self._dicts:
+            self._dicts[dict_id] = self.load_dict(dict_id) if self.load_dict else None
+        return self._dicts[dict_id]
+
+    def use_dict(self, dict_id, data=None):
+        """之后的压缩使用该字典"""
+        if data is not None:
+            self._dicts[dict_id] = data
+        self.dict_id = dict_id
+
+    def encode(self, content):
+        """返回 (content, content_z, content_codec); 未开启压缩或内容较短时原样存储"""
+        if not self.enabled or content is None:
+            return content, None, None
+        raw = content.encode('utf-8')
+        if len(raw) < self.min_bytes:
+            return content, None, None
+
+        zdict = self._dict(self.dict_id)
+        if self.codec == 'zstd':
+            params = {'dict_data': zstandard.ZstdCompressionDict(zdict)} if zdict else {}
+            payload = zstandard.ZstdCompressor(level=9, **params).compress(raw)
+        else:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY,
+                                          **({'zdict': zdict} if zdict else {}))
+            payload = compressor.compress(raw) + compressor.flush()
+        if len(payload) >= len(raw):
+            return content, None, None
+        codec = f"{self.codec}:{self.dict_id}" if zdict else self.codec
+        return None, payload, codec
+
+    def decode(self, content, content_z, content_codec):
+        """读取时解压; 未压缩的行直接返回 content"""
+        if content_z is None or not content_codec:
+            return content
+        name, _, dict_id = content_codec.partition(':')
+        zdict = self._dict(int(dict_id)) if dict_id else None
+        payload = bytes(content_z)
+        if name == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("Post content is zstd-compressed but the zstandard package is not installed")
+            params = {'dict_data': zstandard.ZstdCompressionDict(zdict)} if zdict else {}
+            raw = zstandard.ZstdDecompressor(**params).decompress(payload)
+        else:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, **({'zdict': zdict} if zdict else {}))
+            raw = decompressor.decompress(payload) + decompressor.flush()
+        return raw.decode('utf-8')
@@ -1,33 +1,122 @@
 import os
 import sys
 import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from database import Database
-from crawler import ZsxqCrawler
+from crawler import ZsxqCrawler, COMMENTS_HEADER
+from attachments import AttachmentDownloader
 from notifier import Notifier
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("crawl.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("Crawler")
 
+# app_state 中保存抓取节奏 (AIMD pacer) 的 key
+PACER_STATE_KEY = "crawler_pacer"
 
 
-def fetch_all_data(crawler, group_id):
-    """抓取所有数据源"""
+
+# 同一帖子出现在多个板块时保留信息最丰富的板块; 专栏名不在表中, 优先级最高
+SECTION_PRIORITY = {
+    "精华主题": 3,
+    "问答": 2,
+    "全部主题": 1,
+    "文件分享": 0,
+}
+COLUMN_PRIORITY = 4
+
+def _section_rank(post):
+    return SECTION_PRIORITY.get(post.get('section_name'), COLUMN_PRIORITY)
+
+def dedupe_posts(posts):
+    """按帖子 id 在本轮内去重, 保留板块最丰富的那条, 内容取各板块中最长的 (评论最全)"""
+    best = {}
+    for post in posts:
+        current = best.get(post['id'])
+        if current is None:
+            best[post['id']] = post
+            continue
+        longest = max(current['content'], post['content'], key=len)
+        if _section_rank(post) > _section_rank(current):
+            current = best[post['id']] = dict(post)
+        current['content'] = longest
+    return list(best.values())
+
+def _advance_mark(marks, section_key, items):
+    """用本轮抓到的最新一条更新 section 的高水位线, 并记录没有接上的区间 (items.gap, 见 crawler._fetch_topics)"""
+    newest = max(
+        (item for item in items if item.get('create_time')),
+        key=lambda item: item['create_time'],
+        default=None
+    )
+    mark = marks.get(section_key)
+    if newest is not None and (mark is None or newest['create_time'] > mark['create_time']):
+        mark = {'create_time': newest['create_time'], 'topic_id': newest['id']}
+    if mark is None:
+        return
+    marks[section_key] = dict(mark, gap=getattr(items, 'gap', None))
+
+def fetch_all_data(crawler, group_id, concurrency=None, marks=None):
+    """抓取所有数据源
+
+    concurrency > 1 时各板块和专栏并发抓取 (总并发上限, 单 host 的礼貌限制由 crawler 控制),
+    返回结果的顺序与顺序抓取时一致。多个板块返回的同一帖子在入库前按 id 去重。
+
+    marks 为 Database.get_crawl_marks() 的结果时按高水位线增量抓取, 并就地更新 marks;
+    调用方应在帖子入库后再用 save_crawl_marks() 保存。marks 为 None 时只抓各板块最新一页。
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv("ZSXQ_CRAWL_CONCURRENCY", "4"))
+
+    def fetch_section(section_key, fetch, *args):
+        since = marks.get(section_key) if marks is not None else None
+        return section_key, fetch(*args, since=since)
+
+    if concurrency <= 1:
+        sections = _fetch_all_sequential(crawler, group_id, fetch_section)
+    else:
+        sections = _fetch_all_concurrent(crawler, group_id, fetch_section, concurrency)
+
     fetched_data = []
+    for section_key, items in sections:
+        if marks is not None and section_key:
+            _advance_mark(marks, section_key, items)
+        fetched_data.extend(items)
+
+    unique = dedupe_posts(fetched_data)
+    if len(unique) < len(fetched_data):
+        logger.info(f"De-duplicated {len(fetched_data) - len(unique)} topics seen in multiple sections")
+    return unique
+
+def _fetch_all_concurrent(crawler, group_id, fetch_section, concurrency):
+    logger.info(f"Fetching all sections concurrently (max {concurrency} in flight)...")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        digests = executor.submit(fetch_section, 'digests', crawler.get_group_topics, group_id, 'digests')
+        all_topics = executor.submit(fetch_section, 'all', crawler.get_group_topics, group_id, 'all')
+        columns = executor.submit(crawler.get_group_columns, group_id)
+        files = executor.submit(lambda: (None, crawler.get_group_files(group_id)))
+        questions = executor.submit(fetch_section, 'q_and_a', crawler.get_group_questions, group_id)
+
+        column_futures = []
+        for col in columns.result():
+            col_id = col.get('column_id')
+            col_name = col.get('name')
+            logger.info(f"Fetching articles from column: {col_name} ({col_id})")
+            column_futures.append(executor.submit(
+                fetch_section, f"column:{col_id}", crawler.get_column_articles, group_id, col_id, col_name
+            ))
+
+        return [future.result() for future in [digests, all_topics, *column_futures, files, questions]]
+
+def _fetch_all_sequential(crawler, group_id, fetch_section):
+    sections = []
     
     # A. Fetch Group Topics
     logger.info("Fetching Group topics (all & digests)...")
-    fetched_data.extend(crawler.get_group_topics(group_id, scope='digests'))
-    fetched_data.extend(crawler.get_group_topics(group_id, scope='all'))
+    sections.append(fetch_section('digests', crawler.get_group_topics, group_id, 'digests'))
+    sections.append(fetch_section('all', crawler.get_group_topics, group_id, 'all'))
     
     # B. Fetch Dynamic Columns
     logger.info("Discovering and fetching Column articles...")
@@ -36,33 +125,156 @@ def fetch_all_data(crawler, group_id):
         col_id = col.get('column_id')
         col_name = col.get('name')
         logger.info(f"Fetching articles from column: {col_name} ({col_id})")
-        fetched_data.extend(crawler.get_column_articles(group_id, col_id, col_name))
+        sections.append(fetch_section(f"column:{col_id}", crawler.get_column_articles, group_id, col_id, col_name))
     
-    # C. Fetch Files
+    # C. Fetch Files (文件接口使用独立的游标, 不参与高水位线)
     logger.info("Fetching Group files...")
-    fetched_data.extend(crawler.get_group_files(group_id))
+    sections.append((None, crawler.get_group_files(group_id)))
     
     # D. Fetch Questions
     logger.info("Fetching Group questions...")
-    fetched_data.extend(crawler.get_group_questions(group_id))
+    sections.append(fetch_section('q_and_a', crawler.get_group_questions, group_id))
     
-    return fetched_data
+    return sections
 
 def save_new_posts(db, fetched_data):
-    """保存新帖子到数据库"""
-    new_posts_count = 0
-    for post in fetched_data:
-        if not db.post_exists(post['id']):
-            db.save_post(
-                post['id'], 
-                post['content'], 
-                post['author'], 
-                post['create_time'], 
-                post['url'],
-                post.get('section_name')
-            )
-            new_posts_count += 1
-    return new_posts_count
+    """批量保存新帖子 (已存在的跳过), 返回新帖子数"""
+    return len(db.save_posts_batch(fetched_data))
+
+def sync_comment_threads(db, crawler, posts, group_id=None):
+    """对比已存的评论数/点赞数, 只为评论有变化 (或列表中评论被截断的新帖子) 的帖子拉取完整评论
+
+    完整评论通过有界并发 (ZSXQ_COMMENT_CONCURRENCY) 批量获取, 每轮最多 ZSXQ_MAX_THREAD_FETCHES 个。
+    超出名额或拉取失败的帖子标记 thread_pending (新帖子带标记入库), 之后的轮次用剩余名额补抓该星球的这些帖子。
+    直接修改 posts 中对应帖子的 content, 返回需要 update_post_threads 的已存帖子列表。
+    """
+    topics = [post for post in posts if 'comments_count' in post]
+    stored = db.get_post_counters([post['id'] for post in topics])
+
+    to_fetch = []
+    changed = []
+    for post in topics:
+        truncated = (post['comments_count'] or 0) > post['embedded_comments']
+        if post['id'] not in stored:
+            if truncated:
+                to_fetch.append(post)
+            continue
+
+        previous_comments, previous_likes = stored[post['id']]
+        if (previous_comments, previous_likes) == (post['comments_count'], post['likes_count']):
+            continue
+        if previous_comments is None:
+            # 旧数据没有记录计数: 评论被截断时拉取完整评论 (内容哈希不变就不会重新分析), 否则只补录计数
+            post['content_changed'] = truncated
+        else:
+            post['content_changed'] = previous_comments != post['comments_count']
+        changed.append(post)
+        if post['content_changed'] and truncated:
+            to_fetch.append(post)
+
+    max_fetches = int(os.getenv("ZSXQ_MAX_THREAD_FETCHES", "30"))
+    deferred = to_fetch[max_fetches:]
+    to_fetch = to_fetch[:max_fetches]
+    if deferred:
+        logger.info(f"{len(to_fetch) + len(deferred)} threads changed, fetching {max_fetches} this cycle, "
+                    f"{len(deferred)} marked pending")
+    elif group_id is not None and len(to_fetch) < max_fetches:
+        queued = {post['id'] for post in to_fetch + changed}
+        pending = [post for post in db.get_pending_threads(group_id, max_fetches - len(to_fetch))
+                   if post['id'] not in queued]
+        for post in pending:
+            post['body'] = post['content'].split(COMMENTS_HEADER, 1)[0]
+            post['content_changed'] = True
+        if pending:
+            logger.info(f"Retrying {len(pending)} pending comment threads")
+        to_fetch.extend(pending)
+        changed.extend(pending)
+
+    if to_fetch:
+        logger.info(f"Fetching full comment threads for {len(to_fetch)} topics...")
+        concurrency = int(os.getenv("ZSXQ_COMMENT_CONCURRENCY", "4"))
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            threads = list(executor.map(lambda post: crawler.get_topic_comments(post['id']), to_fetch))
+        for post, comments in zip(to_fetch, threads):
+            if comments is None:
+                deferred.append(post)
+                continue
+            post['content'] = post['body'] + crawler.format_comments(comments)
+
+    # 完整评论这轮没拿到: 新帖子带标记入库, 已存帖子保留原内容, 只更新计数并打标记
+    for post in deferred:
+        post['content_changed'] = False
+        post['thread_pending'] = True
+
+    return changed
+
+def _group_intervals():
+    """解析每个星球的抓取间隔(分钟): ZSXQ_GROUP_INTERVALS=group_id:minutes,..."""
+    intervals = {}
+    for entry in os.getenv("ZSXQ_GROUP_INTERVALS", "").split(','):
+        if ':' not in entry:
+            continue
+        group_id, minutes = entry.split(':', 1)
+        try:
+            intervals[group_id.strip()] = float(minutes)
+        except ValueError:
+            logger.warning(f"Invalid ZSXQ_GROUP_INTERVALS entry: {entry}")
+    return intervals
+
+def is_group_due(db, group_id, intervals):
+    """按星球单独调度: 距上次抓取不足其间隔时跳过本轮"""
+    interval = intervals.get(str(group_id), float(os.getenv("ZSXQ_GROUP_INTERVAL", "0")))
+    if interval <= 0:
+        return True
+    last_run = db.get_group_last_run(group_id)
+    return last_run is None or datetime.now() - last_run >= timedelta(minutes=interval)
+
+def crawl_group(db, crawler, group_id, incremental=True):
+    """抓取单个星球并保存新帖子, 返回新帖子数"""
+    logger.info(f"[{group_id}] Starting crawl cycle...")
+
+    # 抓取数据 (按高水位线增量抓取)
+    marks = db.get_crawl_marks(group_id) if incremental else None
+    fetched_data = fetch_all_data(crawler, group_id, marks=marks)
+    changed_threads = sync_comment_threads(db, crawler, fetched_data, group_id)
+
+    # 帖子、评论更新、高水位线和运行记录在同一个事务中写入, 中途失败时整体回滚
+    with db.transaction():
+        new_count = save_new_posts(db, fetched_data)
+        updated_count = db.update_post_threads(changed_threads)
+        if marks is not None:
+            db.save_crawl_marks(group_id, marks)
+        db.record_group_run(group_id, new_count)
+    if updated_count:
+        logger.info(f"[{group_id}] Updated {updated_count} posts with new comments")
+
+    if os.getenv("ZSXQ_DOWNLOAD_ATTACHMENTS", "false").lower() == "true":
+        AttachmentDownloader(crawler, db).download_all(fetched_data)
+
+    logger.info(f"[{group_id}] Crawl complete. Found {len(fetched_data)} total items, {new_count} new posts.")
+    return new_count
+
+def crawl_groups(db, crawler, group_ids, incremental=True):
+    """并行抓取多个星球, 每个星球占用一个并发名额 (ZSXQ_GROUP_CONCURRENCY), 返回新帖子总数"""
+    intervals = _group_intervals()
+    due = [group_id for group_id in group_ids if is_group_due(db, group_id, intervals)]
+    skipped = len(group_ids) - len(due)
+    if skipped:
+        logger.info(f"Skipping {skipped} group(s) not yet due per ZSXQ_GROUP_INTERVALS")
+    if not due:
+        return 0
+
+    concurrency = max(1, int(os.getenv("ZSXQ_GROUP_CONCURRENCY", "2")))
+    new_count = 0
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(due))) as executor:
+        futures = {executor.submit(crawl_group, db, crawler, group_id, incremental): group_id for group_id in due}
+        for future, group_id in futures.items():
+            try:
+                new_count += future.result()
+            except Exception as e:
+                # 单个星球失败不影响其他星球, 其高水位线未推进, 下轮会重试
+                logger.error(f"[{group_id}] Crawl failed: {e}", exc_info=True)
+    return new_count
 
 def main():
     # 初始化
@@ -70,6 +282,7 @@ def main():
     ding_url = os.getenv("DINGTALK_WEBHOOK")
     ding_secret = os.getenv("DINGTALK_SECRET")
     auto_analyze = os.getenv("AUTO_ANALYZE_AFTER_CRAWL", "true").lower() == "true"
+    incremental = os.getenv("ZSXQ_INCREMENTAL", "true").lower() == "true"
     
     if not cookie:
         logger.error("ZSXQ_COOKIE is not set!")
@@ -78,22 +291,23 @@ def main():
     db = Database()
     notifier = Notifier(ding_url, ding_secret)
     crawler = ZsxqCrawler(cookie, notifier)
+    crawler.pacer.load_state(db.get_state(PACER_STATE_KEY))
     
-    # 动态获取 group_id
-    group_id = crawler.resolve_group_id()
-    if not group_id:
-        logger.error("无法获取 group_id，程序退出")
-        return 1
-    
-    logger.info("Starting crawl cycle...")
-    
-    # 抓取数据
-    fetched_data = fetch_all_data(crawler, group_id)
-    
-    # 保存新帖子
-    new_count = save_new_posts(db, fetched_data)
-    
-    logger.info(f"Crawl complete. Found {len(fetched_data)} total items, {new_count} new posts.")
+    try:
+        # 动态获取 group_id (支持多个星球)
+        group_ids = crawler.resolve_group_ids()
+        if not group_ids:
+            logger.error("无法获取 group_id，程序退出")
+            return 1
+        
+        new_count = crawl_groups(db, crawler, group_ids, incremental=incremental)
+        
+        logger.info(f"Crawl complete for {len(group_ids)} group(s). {new_count} new posts.")
+        crawler.log_latency_stats()
+        db.set_state(PACER_STATE_KEY, crawler.pacer.state())
+    finally:
+        # 出错时也保存 ZSXQ_RECORD_FILE 录制的响应并关闭连接池
+        crawler.close()
     
     # 如果有新帖子且启用自动分析,则调用分析脚本
     if new_count > 0 and auto_analyze:
@@ -109,4 +323,13 @@ def main():
         return 0
 
 if __name__ == "__main__":
+    # 仅在直接运行时配置日志, 避免被 main.py / backfill_comments.py 导入时抢占它们的日志配置
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("crawl.log"),
+            logging.StreamHandler()
+        ]
+    )
     sys.exit(main())
@@ -3,13 +3,65 @@ import random
 import time
 import logging
 import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from pacer import AdaptivePacer
 
 logger = logging.getLogger(__name__)
 
+# 统计耗时时把路径中的数字 id (group / topic / file) 替换为 {id}, 每个 endpoint 一行
+_ID_SEGMENT_RE = re.compile(r'/\d+(?=/|$)')
+
+# 正文与追加的评论之间的分隔, 拆分已存内容时也用它找回正文
+COMMENTS_HEADER = "\n\n--- 回复 ---\n"
+
+
+class TopicList(list):
+    """topics / 帖子列表; gap 为增量抓取没有接上高水位线时留下的区间 (见 _fetch_topics)"""
+    gap = None
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with random jitter added to the exponential backoff,
+    so parallel requests that fail together don't retry in lockstep."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, backoff)
+
+
 class ZsxqCrawler:
-    def __init__(self, cookie, notifier=None):
+    def __init__(self, cookie, notifier=None, pool_size=None, max_retries=None, pacer=None, api_base=None):
         self.cookie = cookie
         self.notifier = notifier
+        # API 地址可指向本地 mock_server.py 以便离线测试/压测
+        self.api_base = (api_base or os.getenv("ZSXQ_API_BASE", "https://api.zsxq.com")).rstrip('/')
+        # 设置 ZSXQ_RECORD_FILE 时把真实响应录制为 mock_server.py 可回放的 fixtures
+        record_file = os.getenv("ZSXQ_RECORD_FILE")
+        if record_file:
+            from mock_server import FixtureStore
+            self.recorder = FixtureStore(record_file)
+        else:
+            self.recorder = None
+        self.pool_size = pool_size or int(os.getenv("ZSXQ_POOL_SIZE", "10"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("ZSXQ_MAX_RETRIES", "3"))
+        self.session = self._build_session()
+        # 每个 endpoint 的请求耗时统计 (秒)
+        self.latency_stats = {}
+        self._stats_lock = threading.Lock()
+        # 单个 host 的礼貌限制: 最大并发数; 请求速率由 AIMD pacer 根据 429/5xx/延迟自动调整
+        # (ZSXQ_MIN_REQUEST_INTERVAL 决定速率上限)
+        self.per_host_limit = int(os.getenv("ZSXQ_PER_HOST_CONCURRENCY", "4"))
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+        self.pacer = pacer or AdaptivePacer()
         self.base_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Cookie': self.cookie,
@@ -22,28 +74,119 @@ class ZsxqCrawler:
             'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36'
         ]
 
+    def _build_session(self):
+        """创建带连接池和传输层重试的 keep-alive session"""
+        retry = JitteredRetry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=1,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+        if self.recorder:
+            self.recorder.save()
+
     def _get_headers(self):
         headers = self.base_headers.copy()
         headers['User-Agent'] = random.choice(self.user_agents)
         return headers
 
+    def _record_latency(self, url, elapsed, ok):
+        endpoint = _ID_SEGMENT_RE.sub('/{id}', urlparse(url).path)
+        with self._stats_lock:
+            stats = self.latency_stats.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0
+            })
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            if not ok:
+                stats['errors'] += 1
+
+    def get_latency_stats(self):
+        """返回每个 endpoint 的请求次数、错误数、平均/最大耗时"""
+        with self._stats_lock:
+            return {
+                endpoint: {
+                    'count': s['count'],
+                    'errors': s['errors'],
+                    'avg': s['total'] / s['count'] if s['count'] else 0.0,
+                    'max': s['max']
+                }
+                for endpoint, s in self.latency_stats.items()
+            }
+
+    def log_latency_stats(self):
+        for endpoint, s in sorted(self.get_latency_stats().items()):
+            logger.info(f"{endpoint}: {s['count']} requests, {s['errors']} errors, "
+                        f"avg {s['avg'] * 1000:.0f}ms, max {s['max'] * 1000:.0f}ms")
+
+    def _acquire_host(self, host):
+        """占用 host 的一个并发名额"""
+        with self._host_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+        slot.acquire()
+        return slot
+
+    @staticmethod
+    def _retry_after(resp):
+        try:
+            return float(resp.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
     def _fetch_api(self, url):
+        slot = self._acquire_host(urlparse(url).netloc)
+        self.pacer.acquire()
+        start = time.monotonic()
+        ok = False
+        status = None
+        retry_after = None
         try:
-            resp = requests.get(url, headers=self._get_headers(), timeout=15)
+            resp = self.session.get(url, headers=self._get_headers(), timeout=15)
+            status = resp.status_code
             if resp.status_code == 401:
                 logger.error("Cookie expired or invalid (401).")
                 if self.notifier:
                     self.notifier.notify_cookie_expired()
                 return None
+            if resp.status_code == 429:
+                retry_after = self._retry_after(resp)
             resp.raise_for_status()
-            return resp.json()
+            data = resp.json()
+            ok = True
+            if self.recorder:
+                self.recorder.record(url, data)
+            return data
         except Exception as e:
             logger.error(f"Error fetching {url}: {e}")
             return None
+        finally:
+            slot.release()
+            elapsed = time.monotonic() - start
+            self.pacer.record(status, elapsed, retry_after=retry_after)
+            self._record_latency(url, elapsed, ok)
 
     def get_user_groups(self):
         """获取用户加入的所有星球列表"""
-        url = "https://api.zsxq.com/v2/groups"
+        url = f"{self.api_base}/v2/groups"
         data = self._fetch_api(url)
         if not data or not data.get('succeeded'):
             return []
@@ -78,6 +221,41 @@ class ZsxqCrawler:
             return match.group(1)
         return None
 
+    def resolve_group_ids(self):
+        """获取需要抓取的所有 group_id
+        优先级:
+        1. 环境变量 ZSXQ_GROUP_IDS (逗号分隔, 支持 ID 或星球 URL)
+        2. 环境变量 ZSXQ_ALL_GROUPS=true (抓取所有已加入的星球)
+        3. resolve_group_id() 的单个星球
+        """
+        group_ids = []
+        configured = os.getenv("ZSXQ_GROUP_IDS")
+        if configured:
+            for value in configured.split(','):
+                value = value.strip()
+                if not value:
+                    continue
+                group_id = value if value.isdigit() else self.extract_group_id_from_url(value)
+                if group_id:
+                    group_ids.append(group_id)
+                else:
+                    logger.error(f"无法从 ZSXQ_GROUP_IDS 中解析 group_id: {value}")
+        elif os.getenv("ZSXQ_ALL_GROUPS", "false").lower() == "true":
+            group_ids = [str(g['group_id']) for g in self.get_user_groups() if g.get('group_id')]
+            if not group_ids and self.notifier:
+                self.notifier.notify_error("API错误", "ZSXQ_ALL_GROUPS=true 但无法获取星球列表",
+                    "请检查 ZSXQ_COOKIE 是否有效以及是否至少加入了一个星球")
+        else:
+            group_id = self.resolve_group_id()
+            if group_id:
+                group_ids.append(str(group_id))
+
+        # 去重并保持顺序
+        group_ids = list(dict.fromkeys(group_ids))
+        if group_ids:
+            logger.info(f"将抓取 {len(group_ids)} 个星球: {', '.join(group_ids)}")
+        return group_ids
+
     def resolve_group_id(self):
         """动态获取 group_id
         优先级:
@@ -139,13 +317,14 @@ class ZsxqCrawler:
                     f"异常类型: {type(e).__name__}\n请查看日志文件获取详细堆栈信息")
             return None
 
-    def _extract_comments(self, topic):
-        """提取帖子的回复信息"""
+    @staticmethod
+    def _embedded_comments(topic):
         # 尝试多个可能的字段名
-        comments = topic.get('comments', []) or topic.get('show_comments', []) or topic.get('latest_comments', [])
-        if not comments:
-            return ""
-        
+        return topic.get('comments', []) or topic.get('show_comments', []) or topic.get('latest_comments', [])
+
+    @staticmethod
+    def format_comments(comments):
+        """把评论列表格式化为追加在正文后的回复文本"""
         comment_texts = []
         for comment in comments:
             text = comment.get('text', '')
@@ -154,102 +333,228 @@ class ZsxqCrawler:
                 comment_texts.append(f"【{author}】: {text}")
         
         if comment_texts:
-            return "\n\n--- 回复 ---\n" + "\n".join(comment_texts)
+            return COMMENTS_HEADER + "\n".join(comment_texts)
         return ""
 
-    def get_group_topics(self, group_id, scope='all'):
-        """
-        scope: 'all' or 'digests'
+    def get_topic_comments(self, topic_id, max_pages=None):
+        """从评论接口按时间正序翻页获取帖子的完整评论 (含楼中楼回复)
+
+        任意一页失败都返回 None (不返回不完整的评论), 调用方保留 thread_pending 下一轮重试;
+        超过 max_pages 页的评论只保留前面的部分。
         """
-        url = f"https://api.zsxq.com/v2/groups/{group_id}/topics?scope={scope}&count=20"
+        if max_pages is None:
+            max_pages = int(os.getenv("ZSXQ_COMMENT_MAX_PAGES", "10"))
+        comments = []
+        begin_time = None
+        for page in range(max_pages):
+            url = f"{self.api_base}/v2/topics/{topic_id}/comments?sort=asc&count=30&with_sticky=true"
+            if begin_time:
+                url += f"&begin_time={quote(begin_time)}"
+            data = self._fetch_api(url)
+            if not data or not data.get('succeeded'):
+                return None
+            resp = data.get('resp') or data.get('resp_data') or {}
+            page_comments = resp.get('comments', [])
+            for comment in page_comments:
+                comments.append(comment)
+                comments.extend(comment.get('replied_comments') or [])
+            if len(page_comments) < 30:
+                break
+            begin_time = self.next_cursor(page_comments[-1].get('create_time'))
+        return comments
+
+    @staticmethod
+    def _shift_cursor(create_time, milliseconds):
+        try:
+            dt = datetime.strptime(create_time, "%Y-%m-%dT%H:%M:%S.%f%z") + timedelta(milliseconds=milliseconds)
+            return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}" + dt.strftime("%z")
+        except (TypeError, ValueError):
+            return create_time
+
+    @classmethod
+    def previous_cursor(cls, create_time):
+        """end_time 游标: 比本页最旧一条再早 1 毫秒, 避免下一页重复返回它"""
+        return cls._shift_cursor(create_time, -1)
+
+    @classmethod
+    def next_cursor(cls, create_time):
+        """begin_time 游标: 比本页最新一条再晚 1 毫秒"""
+        return cls._shift_cursor(create_time, 1)
+
+    @staticmethod
+    def latest_cursor():
+        """从最新一页开始翻页时使用的 end_time (当前时间之后, 北京时间)"""
+        dt = datetime.now(timezone(timedelta(hours=8))) + timedelta(minutes=1)
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.000%z")
+
+    @staticmethod
+    def _is_seen(topic, since):
+        """判断 topic 是否不晚于高水位线 (create_time, topic_id)"""
+        create_time = topic.get('create_time') or ''
+        if create_time < since['create_time']:
+            return True
+        return create_time == since['create_time'] and str(topic.get('topic_id')) == str(since.get('topic_id'))
+
+    def fetch_topics_page(self, group_id, scope, column_id=None, end_time=None, count=20):
+        """抓取一页原始 topics, end_time 为向前翻页的游标"""
+        url = f"{self.api_base}/v2/groups/{group_id}/topics?scope={scope}&count={count}"
+        if column_id:
+            url += f"&column_id={column_id}"
+        if end_time:
+            url += f"&end_time={quote(end_time)}"
         data = self._fetch_api(url)
         if not data or not data.get('succeeded'):
-            return []
-        
-        # Determine section name based on scope
-        section_name = "精华主题" if scope == 'digests' else "全部主题"
-        
+            return None
         resp = data.get('resp') or data.get('resp_data') or {}
-        topics = resp.get('topics', [])
+        return resp.get('topics', [])
+
+    def _page_back(self, group_id, scope, column_id, end_time, floor, max_pages, count):
+        """从 end_time 游标向前翻页, 直到遇到不晚于 floor 的 topic、末页或 max_pages
+
+        返回 (topics, 续抓游标, 用掉的页数, 是否接上 floor); 第一页的 topic 全部返回 (用于比对评论/点赞数),
+        之后的页只返回 floor 之后的。请求失败或页数用完时没有接上。
+        """
         results = []
-        for t in topics:
-            topic_id = t.get('topic_id')
-            # Handle different content structures
-            talk = t.get('talk', {})
-            content = talk.get('text', '')
-            author = talk.get('owner', {}).get('name', 'Unknown')
-            create_time = t.get('create_time')
-            url_link = f"https://wx.zsxq.com/dweb2/index/group/{group_id}/topic/{topic_id}"
-            
-            # Simple fallback for content
-            if not content:
-                article = t.get('article', {})
-                content = f"{article.get('title', '')} {article.get('text', '')}"
-            
-            # Extract and append comments
-            comments_text = self._extract_comments(t)
-            full_content = content.strip() + comments_text
-                
-            results.append({
-                'id': str(topic_id),
-                'content': full_content,
-                'author': author,
-                'create_time': create_time,
-                'url': url_link,
-                'section_name': section_name
-            })
+        for page in range(max_pages):
+            topics = self.fetch_topics_page(group_id, scope, column_id, end_time=end_time, count=count)
+            if topics is None:
+                return results, end_time, page + 1, False
+            fresh = [t for t in topics if not self._is_seen(t, floor)]
+            results.extend(topics if page == 0 else fresh)
+            if len(fresh) < len(topics) or len(topics) < count:
+                return results, end_time, page + 1, True
+            end_time = self.previous_cursor(topics[-1].get('create_time'))
+        return results, end_time, max_pages, False
+
+    def _fetch_topics(self, group_id, scope, column_id=None, since=None, max_pages=None, end_time=None, count=20):
+        """抓取 topics
+
+        end_time 不为空时只抓该游标之前的一页 (用于历史回填);
+        since 为空时只抓最新一页; 否则按 end_time 游标向前翻页, 直到遇到已抓取过的
+        topic (高水位线) 或达到 max_pages。返回高水位线之后的新 topic, 以及第一页中
+        已抓取过的 topic (用于比对评论/点赞数的变化)。
+
+        请求失败或页数用完时没有接上高水位线, 中间没抓到的区间作为返回值 (TopicList) 的 gap
+        ({'end_time': 续抓游标, 'floor': 区间下界}) 返回, 调用方把它存入高水位线 (since['gap']);
+        之后的轮次抓完最新的 topic 后用剩余页数从 gap 继续向前翻页, 接上 floor 后 gap 为 None。
+        """
+        if end_time:
+            return self.fetch_topics_page(group_id, scope, column_id, end_time=end_time, count=count)
+        if not since:
+            return self.fetch_topics_page(group_id, scope, column_id, count=count) or []
+
+        if max_pages is None:
+            max_pages = int(os.getenv("ZSXQ_MAX_PAGES", "5"))
+
+        label = f"{scope} {column_id or ''}".strip()
+        gap = since.get('gap')
+        floor = {'create_time': since['create_time'], 'topic_id': since.get('topic_id')}
+        topics, cursor, pages, complete = self._page_back(group_id, scope, column_id, None, floor, max_pages, count)
+        results = TopicList(topics)
+        if not complete:
+            if cursor is None:
+                # 第一页就失败了: 高水位线不会推进, 原来的 gap 保持不变
+                logger.warning(f"Failed to fetch the latest {label} topics, will retry next cycle")
+            else:
+                # 与更早的 gap 合并为一个区间 (中间已抓过的部分会重新翻一遍, 入库时跳过)
+                gap = {'end_time': cursor, 'floor': gap['floor'] if gap else floor}
+                logger.warning(f"Stopped before the high-water mark for {label} after {pages} pages, "
+                               f"resuming from {cursor} next cycle")
+            results.gap = gap
+            return results
+
+        if gap and pages < max_pages:
+            topics, cursor, _, complete = self._page_back(
+                group_id, scope, column_id, gap['end_time'], gap['floor'], max_pages - pages, count
+            )
+            results.extend(topics)
+            gap = None if complete else {'end_time': cursor, 'floor': gap['floor']}
+            if gap:
+                logger.info(f"Gap below the high-water mark for {label} not closed yet, resuming from {cursor} next cycle")
+            else:
+                logger.info(f"Closed the gap below the high-water mark for {label}")
+        results.gap = gap
         return results
 
-    def get_column_articles(self, group_id, column_id, column_name="专栏"):
-        url = f"https://api.zsxq.com/v2/groups/{group_id}/topics?scope=by_column&column_id={column_id}&count=20"
-        data = self._fetch_api(url)
-        if not data or not data.get('succeeded'):
-            return []
-        
-        resp = data.get('resp') or data.get('resp_data') or {}
-        topics = resp.get('topics', [])
-        results = []
+    @staticmethod
+    def _topic_body(topic):
+        """按 talk -> article -> question_answer 的顺序提取正文和作者"""
+        talk = topic.get('talk') or {}
+        if talk.get('text'):
+            return talk['text'], talk.get('owner', {}).get('name', 'Unknown')
+
+        article = topic.get('article') or {}
+        article_text = f"{article.get('title', '')} {article.get('text', '')}".strip()
+        if article_text:
+            owner = talk.get('owner') or article.get('owner') or {}
+            return article_text, owner.get('name', 'Unknown')
+
+        q_and_a = topic.get('question_answer') or {}
+        if q_and_a:
+            question = q_and_a.get('question', {}).get('text', '')
+            answer = q_and_a.get('answer', {}).get('text', '')
+            author = q_and_a.get('answer', {}).get('owner', {}).get('name', 'Unknown')
+            return f"[问答]\n问：{question}\n答：{answer}", author
+
+        return '', talk.get('owner', {}).get('name', 'Unknown')
+
+    def iter_topic_posts(self, topics, group_id, section_name):
+        """把 API 返回的原始 topics 逐条转换为帖子记录 (talk/article/问答 + 评论)"""
         for t in topics:
             topic_id = t.get('topic_id')
-            # Handle different content structures
-            talk = t.get('talk', {})
-            content = talk.get('text', '')
-            author = talk.get('owner', {}).get('name', 'Unknown')
-            create_time = t.get('create_time')
-            url_link = f"https://wx.zsxq.com/dweb2/index/group/{group_id}/topic/{topic_id}"
-            
-            # Simple fallback for content
-            if not content:
-                article = t.get('article', {})
-                content = f"{article.get('title', '')} {article.get('text', '')}"
-            
-            # Fallback 2: Check for question/answer if mixed in
-            if not content:
-                q_and_a = t.get('question_answer', {})
-                if q_and_a:
-                    question = q_and_a.get('question', {}).get('text', '')
-                    answer = q_and_a.get('answer', {}).get('text', '')
-                    content = f"[问答]\n问：{question}\n答：{answer}"
-            
+            content, author = self._topic_body(t)
+
             # Extract and append comments
-            comments_text = self._extract_comments(t)
-            full_content = content.strip() + comments_text
+            embedded = self._embedded_comments(t)
+            comments_text = self.format_comments(embedded)
 
-            results.append({
+            yield {
                 'id': str(topic_id),
-                'content': full_content,
+                'content': content.strip() + comments_text,
                 'author': author,
-                'create_time': create_time,
-                'url': url_link,
-                'section_name': column_name
-            })
-        return results
+                'create_time': t.get('create_time'),
+                'url': f"https://wx.zsxq.com/dweb2/index/group/{group_id}/topic/{topic_id}",
+                'section_name': section_name,
+                'group_id': str(group_id),
+                'body': content.strip(),
+                'comments_count': t.get('comments_count', len(embedded)),
+                'likes_count': t.get('likes_count', 0),
+                'embedded_comments': len(embedded)
+            }
+
+    def _topic_posts(self, topics, group_id, section_name):
+        """topics -> 帖子列表, 保留 _fetch_topics 返回的 gap"""
+        posts = TopicList(self.iter_topic_posts(topics, group_id, section_name))
+        posts.gap = getattr(topics, 'gap', None)
+        return posts
+
+    def get_group_topics(self, group_id, scope='all', since=None, max_pages=None, end_time=None):
+        """
+        scope: 'all' or 'digests'
+        since: 高水位线 {'create_time': ..., 'topic_id': ...}, 为空时只抓最新一页
+        end_time: 翻页游标, 只抓该时间之前的一页
+
+        end_time 模式下请求失败返回 None, 以便回填时与 "已到末页" 区分。
+        """
+        topics = self._fetch_topics(group_id, scope, since=since, max_pages=max_pages, end_time=end_time)
+        if topics is None:
+            return None
+        
+        # Determine section name based on scope
+        section_name = "精华主题" if scope == 'digests' else "全部主题"
+        return self._topic_posts(topics, group_id, section_name)
+
+    def get_column_articles(self, group_id, column_id, column_name="专栏", since=None, max_pages=None, end_time=None):
+        topics = self._fetch_topics(group_id, 'by_column', column_id=column_id, since=since, max_pages=max_pages, end_time=end_time)
+        if topics is None:
+            return None
+        return self._topic_posts(topics, group_id, column_name)
 
     def get_group_columns(self, group_id):
         """
         Fetches the list of all columns associated with a group.
         """
-        url = f"https://api.zsxq.com/v2/groups/{group_id}/columns"
+        url = f"{self.api_base}/v2/groups/{group_id}/columns"
         data = self._fetch_api(url)
         if not data or not data.get('succeeded'):
             return []
@@ -261,7 +566,7 @@ class ZsxqCrawler:
         """
         Fetches the latest files shared in the group.
         """
-        url = f"https://api.zsxq.com/v2/groups/{group_id}/files?count=20"
+        url = f"{self.api_base}/v2/groups/{group_id}/files?count=20"
         data = self._fetch_api(url)
         if not data or not data.get('succeeded'):
             return []
@@ -283,48 +588,35 @@ class ZsxqCrawler:
                 'author': author,
                 'create_time': create_time,
                 'url': url_link,
-                'section_name': "文件分享"
+                'section_name': "文件分享",
+                'group_id': str(group_id),
+                'file_id': file_id,
+                'file_name': name,
+                'file_size': f.get('size')
             })
         return results
 
-    def get_group_questions(self, group_id):
-        """
-        Fetches Q&A content.
-        """
-        url = f"https://api.zsxq.com/v2/groups/{group_id}/topics?scope=q_and_a&count=20"
+    def get_file_download_url(self, file_id):
+        """解析文件的真实下载地址 (带签名的临时 URL)"""
+        url = f"{self.api_base}/v2/files/{file_id}/download_url"
         data = self._fetch_api(url)
         if not data or not data.get('succeeded'):
-            return []
-        
+            return None
         resp = data.get('resp') or data.get('resp_data') or {}
-        topics = resp.get('topics', [])
-        results = []
-        for t in topics:
-            topic_id = t.get('topic_id')
-            q_and_a = t.get('question_answer', {})
-            question = q_and_a.get('question', {}).get('text', '')
-            answer = q_and_a.get('answer', {}).get('text', '')
-            author = q_and_a.get('answer', {}).get('owner', {}).get('name', 'Unknown')
-            create_time = t.get('create_time')
-            url_link = f"https://wx.zsxq.com/dweb2/index/group/{group_id}/topic/{topic_id}"
-            
-            content = f"[问答]\n问：{question}\n答：{answer}"
-            
-            # Extract and append comments
-            comments_text = self._extract_comments(t)
-            full_content = content.strip() + comments_text
-            
-            results.append({
-                'id': str(topic_id),
-                'content': full_content,
-                'author': author,
-                'create_time': create_time,
-                'url': url_link,
-                'section_name': "问答"
-            })
-        return results
+        return resp.get('download_url')
+
+    def open_download(self, url, offset=0):
+        """以流式方式打开下载, offset > 0 时通过 Range 头断点续传"""
+        headers = {'User-Agent': self._get_headers()['User-Agent'], 'Referer': 'https://wx.zsxq.com/'}
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+        return self.session.get(url, headers=headers, stream=True, timeout=(15, 60))
 
-    def sleep_random(self):
-        delay = random.uniform(30, 60)
-        logger.info(f"Sleeping for {delay:.2f} seconds...")
-        time.sleep(delay)
+    def get_group_questions(self, group_id, since=None, max_pages=None, end_time=None):
+        """
+        Fetches Q&A content.
+        """
+        topics = self._fetch_topics(group_id, 'q_and_a', since=since, max_pages=max_pages, end_time=end_time)
+        if topics is None:
+            return None
+        return self._topic_posts(topics, group_id, "问答")
@@ -1,15 +1,113 @@
+import io
 import os
+import re
+import csv
+import json
+import uuid
+import socket
+import hashlib
 import sqlite3
 import logging
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from tickers import default_normalizer
+from compression import ContentCodec, train_dictionary
+from simhash import simhash, bands, hamming_distance, group_near_duplicates, to_signed, to_unsigned
 try:
     import psycopg2
+    import psycopg2.pool
+    import psycopg2.extras
 except ImportError:
     psycopg2 = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 单条 SQL 的参数个数上限 (SQLite 默认 999), 批量查询按此分块
+BATCH_SIZE = 500
+# PostgreSQL 下超过该行数时改用 COPY 写入临时表再合并
+COPY_THRESHOLD = int(os.getenv("DB_COPY_THRESHOLD", "2000"))
+
+POST_COLUMNS = ('id', 'content', 'content_z', 'content_codec', 'content_hash', 'author', 'create_time', 'create_ts',
+                'url', 'section_name', 'group_id', 'comments_count', 'likes_count', 'thread_pending')
+
+# 归档表的列 (类型为 None 的是 BLOB/BYTEA), 同时也是统一视图 all_posts 的列
+ARCHIVE_COLUMNS = (
+    ('id', 'TEXT PRIMARY KEY'), ('content', 'TEXT'), ('content_z', None), ('content_codec', 'TEXT'),
+    ('content_hash', 'TEXT'), ('author', 'TEXT'), ('create_time', 'TEXT'), ('create_ts', 'BIGINT'), ('url', 'TEXT'),
+    ('section_name', 'TEXT'), ('is_analyzed', 'INTEGER'), ('ticker', 'TEXT'), ('suggestion', 'TEXT'),
+    ('logic', 'TEXT'), ('ai_summary', 'TEXT'), ('group_id', 'TEXT'), ('comments_count', 'INTEGER'),
+    ('likes_count', 'INTEGER'), ('is_valuable', 'INTEGER'),
+)
+ARCHIVE_COLUMN_NAMES = ", ".join(name for name, _ in ARCHIVE_COLUMNS)
+
+def _archive_table_sql(table, blob_type):
+    columns = ",\n".join(f"    {name} {column_type or blob_type}" for name, column_type in ARCHIVE_COLUMNS)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n{columns},\n    archived_at TEXT\n)"
+
+# 中文没有空格分词, 全文索引按相邻两个汉字 (bigram) 切分, 英文/数字按整词
+_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9A-Za-z]+')
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+def search_tokens(text):
+    """'宁德时代 CATL' -> ['宁德', '德时', '时代', 'catl']; 单个汉字保留为一个词"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text or ''):
+        if _CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+def _search_text(text):
+    return ' '.join(search_tokens(text))
+
+def content_hash(content):
+    """帖子内容的 SHA-256, 用于判断内容是否变化"""
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+def worker_id():
+    """分析进程的租约持有者标识 (主机名:pid:随机串), 见 Database.claim_posts"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def parse_create_time(value):
+    """把 '2024-01-01T12:00:00.000+0800' 形式的 create_time 转为 epoch 秒, 无法解析时返回 None"""
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+def _snippet(content, terms, width=40):
+    """截取 content 中第一个命中词附近的文字"""
+    content = (content or '').replace('\n', ' ')
+    lowered = content.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [pos for pos in positions if pos >= 0]
+    if not positions:
+        return content[:width * 2]
+    start = max(0, min(positions) - width)
+    end = min(len(content), min(positions) + width)
+    return ('...' if start else '') + content[start:end] + ('...' if end < len(content) else '')
+
 class Database:
+    """
+    Connections are reused instead of opened per call:
+    - PostgreSQL: a ThreadedConnectionPool (DB_POOL_MIN / DB_POOL_MAX connections).
+    - SQLite: one connection per thread, in WAL mode so readers don't block the writer.
+
+    Methods use transaction() for writes (commit on success, rollback on error)
+    and cursor() for reads.
+    """
+
     def __init__(self, db_path="zsxq_investment.db"):
         self.db_path = db_path
         self.db_url = os.getenv("DATABASE_URL")
@@ -19,13 +117,150 @@ class Database:
             logger.warning("DATABASE_URL is set but psycopg2 is not installed. Falling back to SQLite.")
             self.use_postgres = False
 
+        self._pool = None
+        self._local = threading.local()
+        self._sqlite_conns = []
+        self._sqlite_lock = threading.Lock()
+        if self.use_postgres:
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                int(os.getenv("DB_POOL_MIN", "1")),
+                int(os.getenv("DB_POOL_MAX", "8")),
+                self.db_url
+            )
+
+        # content 压缩仅用于 SQLite 文件; PostgreSQL 的 TOAST 已经会压缩大字段
+        codec = os.getenv("DB_COMPRESS_CONTENT", "off").lower()
+        if self.use_postgres and codec != "off":
+            logger.info("DB_COMPRESS_CONTENT is ignored on PostgreSQL (large values are compressed by TOAST)")
+        self.codec = ContentCodec(
+            codec=None if self.use_postgres else codec,
+            min_bytes=int(os.getenv("DB_COMPRESS_MIN_BYTES", "1024")),
+            load_dict=self._load_compression_dict
+        )
+
+        # 归档: 已分析且超过 ARCHIVE_AFTER_DAYS 天的帖子移到 investment_posts_archive;
+        # SQLite 可以用 ARCHIVE_DB_PATH 把归档放到单独的文件 (ATTACH 为 archive)
+        self.archive_after_days = int(os.getenv("ARCHIVE_AFTER_DAYS") or "0")
+        self.archive_path = None if self.use_postgres else os.getenv("ARCHIVE_DB_PATH")
+        schema = "archive." if self.archive_path else ("" if self.use_postgres else "main.")
+        self.archive_table = f"{schema}investment_posts_archive"
+        self.archive_fts = f"{schema}posts_archive_fts"
+        # 归档表的版本号记录在归档表所在的库里, 单独的归档文件也能按版本迁移
+        self.archive_version_table = f"{schema}archive_schema_version"
+        self._archive_ready = False
+
+        # AI 分析结果缓存 (analysis_cache): 超过 TTL 的条目不再使用, 超过上限时淘汰最久未命中的
+        self.analysis_cache_ttl_days = int(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "90"))
+        self.analysis_cache_max_entries = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "20000"))
+
+        # 近似重复: SimHash 海明距离不超过该值的已分析帖子, 其分析结果直接复用 (0 为不复用, 最大 3)
+        self.simhash_max_distance = min(3, int(os.getenv("SIMHASH_MAX_DISTANCE", "3")))
+
         self._create_table()
+        self._migrate(self.ARCHIVE_MIGRATIONS, self.archive_version_table)
+        self._archive_ready = True
+        if not self.use_postgres:
+            self._setup_sqlite_archive(self._sqlite_conn())
+        if self.codec.enabled:
+            self.codec.use_dict(self._latest_compression_dict(self.codec.codec))
 
-    def _get_conn(self):
-        if self.use_postgres:
-            return psycopg2.connect(self.db_url)
-        else:
-            return sqlite3.connect(self.db_path)
+    def _sqlite_conn(self):
+        """当前线程的 SQLite 连接, 首次使用时创建"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            # 全文索引触发器中使用
+            conn.create_function("search_text", 1, _search_text, deterministic=True)
+            conn.create_function("post_content", 3, self.codec.decode, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            if self.archive_path:
+                conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            if self._archive_ready:
+                self._setup_sqlite_archive(conn)
+            self._local.conn = conn
+            with self._sqlite_lock:
+                self._sqlite_conns.append(conn)
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        if not self.use_postgres:
+            yield self._sqlite_conn()
+            return
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            # 连接已断开时丢弃, 下次由连接池重新建立
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    @contextmanager
+    def transaction(self):
+        """写操作: 正常结束时提交, 出错时回滚并抛出异常
+
+        可以嵌套: 同一线程内已处于 transaction() 中时, 内层调用复用外层的游标,
+        由最外层统一提交, 这样一轮抓取的多次写入可以放在同一个事务里。
+        """
+        outer = getattr(self._local, 'tx_cursor', None)
+        if outer is not None:
+            yield outer
+            return
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            self._local.tx_cursor = cursor
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._local.tx_cursor = None
+                cursor.close()
+
+    @contextmanager
+    def cursor(self):
+        """只读查询; PostgreSQL 下结束后回滚, 避免连接停留在事务中
+
+        在 transaction() 内调用时复用事务游标, 可以读到尚未提交的写入。
+        """
+        outer = getattr(self._local, 'tx_cursor', None)
+        if outer is not None:
+            yield outer
+            return
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+                if self.use_postgres and not conn.closed:
+                    conn.rollback()
+
+    def close(self):
+        """关闭所有连接"""
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+        with self._sqlite_lock:
+            for conn in self._sqlite_conns:
+                conn.close()
+            self._sqlite_conns.clear()
+        self._local = threading.local()
+
+    def _setup_sqlite_archive(self, conn):
+        """SQLite 的统一视图 all_posts 是 TEMP VIEW (主库不能引用 ATTACH 的库), 每个连接上创建一次
+
+        归档表本身由 ARCHIVE_MIGRATIONS 创建和升级。
+        """
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS all_posts AS
+            SELECT {ARCHIVE_COLUMN_NAMES} FROM main.investment_posts
+            UNION ALL
+            SELECT {ARCHIVE_COLUMN_NAMES} FROM {self.archive_table}
+        ''')
 
     def _prepare_query(self, query):
         """Adapt query placeholders for the target database."""
@@ -33,134 +268,1400 @@ class Database:
             return query.replace('?', '%s')
         return query
 
-    def _create_table(self):
-        conn = self._get_conn()
-        try:
-            cursor = conn.cursor()
-            query = '''
-                CREATE TABLE IF NOT EXISTS investment_posts (
-                    id TEXT PRIMARY KEY,
-                    content TEXT,
-                    author TEXT,
-                    create_time TEXT,
-                    url TEXT,
-                    section_name TEXT,
-                    is_analyzed INTEGER DEFAULT 0,
-                    ticker TEXT,
-                    suggestion TEXT,
-                    logic TEXT,
-                    ai_summary TEXT
-                )
-            '''
-            cursor.execute(self._prepare_query(query))
-            conn.commit()  # Explicit commit for both SQLite and PostgreSQL
-            
-            # Migration: Add section_name column if it doesn't exist
+    def _column_exists(self, cursor, table, column):
+        if self.use_postgres:
+            cursor.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                (table, column)
+            )
+            return cursor.fetchone() is not None
+        if '.' in table:
+            # ATTACH 的库: PRAGMA archive.table_info(investment_posts_archive)
+            schema, table = table.split('.', 1)
+            cursor.execute(f"PRAGMA {schema}.table_info({table})")
+        else:
+            cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+
+    def _add_column(self, cursor, table, column, column_type):
+        """列不存在时添加"""
+        if not self._column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            logger.info(f"Added {column} column to {table}")
+
+    def _migration_1(self, cursor):
+        """旧版本数据库中启动时逐个 ALTER 的列"""
+        self._add_column(cursor, "investment_posts", "section_name", "TEXT")
+        self._add_column(cursor, "investment_posts", "group_id", "TEXT")
+        # 评论数/点赞数, 用于判断评论线程是否有变化
+        self._add_column(cursor, "investment_posts", "comments_count", "INTEGER")
+        self._add_column(cursor, "investment_posts", "likes_count", "INTEGER")
+
+    def _migration_2(self, cursor):
+        """create_ts: create_time 对应的 epoch 秒, 带索引, 替代按文本排序"""
+        self._add_column(cursor, "investment_posts", "create_ts", "BIGINT")
+        cursor.execute("SELECT id, create_time FROM investment_posts WHERE create_ts IS NULL")
+        updates = [(parse_create_time(create_time), post_id) for post_id, create_time in cursor.fetchall()]
+        updates = [row for row in updates if row[0] is not None]
+        if updates:
+            cursor.executemany(self._prepare_query("UPDATE investment_posts SET create_ts = ? WHERE id = ?"), updates)
+            logger.info(f"Backfilled create_ts for {len(updates)} posts")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_create_ts ON investment_posts (create_ts)")
+        # 部分索引只包含未分析的帖子, 取待分析队列时不再全表扫描
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_posts_unanalyzed ON investment_posts (create_ts) WHERE is_analyzed = 0"
+        )
+
+    def _migration_3(self, cursor):
+        """content_hash: 回填/评论更新时只有内容真正变化的帖子才重新进入分析队列"""
+        self._add_column(cursor, "investment_posts", "content_hash", "TEXT")
+        cursor.execute("SELECT id, content FROM investment_posts WHERE content_hash IS NULL")
+        updates = [(content_hash(content), post_id) for post_id, content in cursor.fetchall()]
+        if updates:
+            cursor.executemany(self._prepare_query("UPDATE investment_posts SET content_hash = ? WHERE id = ?"), updates)
+            logger.info(f"Backfilled content_hash for {len(updates)} posts")
+
+    def _migration_4(self, cursor):
+        """全文索引: content / logic / ai_summary
+
+        - SQLite: FTS5 表 posts_fts, rowid 与 investment_posts 的 rowid 对应, 存 bigram 切分后的文本,
+          由触发器保持同步 (search_text 为每个连接注册的 Python 函数)
+        - PostgreSQL: 生成列 search_text + pg_trgm GIN 索引
+        """
+        if self.use_postgres:
+            cursor.execute("SAVEPOINT search_trgm")
             try:
-                alter_query = "ALTER TABLE investment_posts ADD COLUMN section_name TEXT"
-                cursor.execute(self._prepare_query(alter_query))
-                conn.commit()
-                logger.info("Added section_name column to existing table")
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
             except Exception as e:
-                # Ignore if column exists or any other error
-                # For PostgreSQL, this might be DuplicateColumn
-                # For SQLite, this might be OperationalError
-                conn.rollback()  # Rollback the failed ALTER
-                pass
+                cursor.execute("ROLLBACK TO SAVEPOINT search_trgm")
+                logger.warning(f"pg_trgm is not available, search will not be indexed: {e}")
+            if not self._column_exists(cursor, "investment_posts", "search_text"):
+                cursor.execute('''
+                    ALTER TABLE investment_posts ADD COLUMN search_text TEXT GENERATED ALWAYS AS (
+                        COALESCE(content, '') || ' ' || COALESCE(logic, '') || ' ' || COALESCE(ai_summary, '')
+                    ) STORED
+                ''')
+            if self._has_trgm(cursor):
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_posts_search_trgm ON investment_posts "
+                    "USING gin (search_text gin_trgm_ops)"
+                )
+            return
+
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(content, logic, ai_summary)"
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 is not available, search will fall back to LIKE: {e}")
+            return
+        self._create_fts_triggers(cursor)
+        self._rebuild_fts(cursor)
+
+    @staticmethod
+    def _fts_content(row, compressed):
+        if compressed:
+            return f"post_content({row}.content, {row}.content_z, {row}.content_codec)"
+        return f"{row}.content"
+
+    def _create_fts_triggers(self, cursor, compressed=False):
+        content = self._fts_content('new', compressed)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON investment_posts BEGIN
+                INSERT INTO posts_fts (rowid, content, logic, ai_summary)
+                VALUES (new.rowid, search_text({content}), search_text(new.logic), search_text(new.ai_summary));
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON investment_posts BEGIN
+                DELETE FROM posts_fts WHERE rowid = old.rowid;
+            END
+        ''')
+        columns = "content, content_z, logic, ai_summary" if compressed else "content, logic, ai_summary"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF {columns}
+            ON investment_posts BEGIN
+                DELETE FROM posts_fts WHERE rowid = old.rowid;
+                INSERT INTO posts_fts (rowid, content, logic, ai_summary)
+                VALUES (new.rowid, search_text({content}), search_text(new.logic), search_text(new.ai_summary));
+            END
+        ''')
+
+    def _rebuild_fts(self, cursor):
+        compressed = self._column_exists(cursor, "investment_posts", "content_z")
+        content = self._fts_content('investment_posts', compressed)
+        cursor.execute("DELETE FROM posts_fts")
+        cursor.execute(f'''
+            INSERT INTO posts_fts (rowid, content, logic, ai_summary)
+            SELECT rowid, search_text({content}), search_text(logic), search_text(ai_summary) FROM investment_posts
+        ''')
+
+    def _migration_5(self, cursor):
+        """post_tickers: 分析结果按标的拆分并归一, 按标的查询最新观点时走索引"""
+        cursor.execute(self._prepare_query('''
+            CREATE TABLE IF NOT EXISTS post_tickers (
+                post_id TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                raw_ticker TEXT,
+                suggestion TEXT,
+                create_ts BIGINT,
+                PRIMARY KEY (post_id, ticker)
+            )
+        '''))
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_tickers_ticker ON post_tickers (ticker, create_ts)")
+        self._rebuild_post_tickers(cursor)
+
+    def _migration_6(self, cursor):
+        """可选的 content 压缩 (DB_COMPRESS_CONTENT): content_z / content_codec 列和共享字典表"""
+        # PostgreSQL 下这两列始终为空, 保留只是为了两种数据库共用同一套 SQL
+        self._add_column(cursor, "investment_posts", "content_z", "BYTEA" if self.use_postgres else "BLOB")
+        self._add_column(cursor, "investment_posts", "content_codec", "TEXT")
+        if self.use_postgres:
+            # PostgreSQL 14+ 可以让 TOAST 使用 lz4, 旧版本保持默认的 pglz
+            cursor.execute("SAVEPOINT content_lz4")
+            try:
+                cursor.execute("ALTER TABLE investment_posts ALTER COLUMN content SET COMPRESSION lz4")
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT content_lz4")
+            return
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS compression_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_at TEXT
+            )
+        ''')
+        # 全文索引触发器改为读取解压后的内容
+        if self._has_fts(cursor):
+            for trigger in ("posts_fts_insert", "posts_fts_update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            self._create_fts_triggers(cursor, compressed=True)
+
+    def _migration_7(self, cursor):
+        """PostgreSQL 归档表和统一视图 all_posts (SQLite 见 _setup_sqlite_archive)"""
+        if not self.use_postgres:
+            return
+        cursor.execute(_archive_table_sql(self.archive_table, "BYTEA"))
+        if not self._column_exists(cursor, "investment_posts_archive", "search_text"):
+            cursor.execute('''
+                ALTER TABLE investment_posts_archive ADD COLUMN search_text TEXT GENERATED ALWAYS AS (
+                    COALESCE(content, '') || ' ' || COALESCE(logic, '') || ' ' || COALESCE(ai_summary, '')
+                ) STORED
+            ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_archive_create_ts ON investment_posts_archive (create_ts)")
+        if self._has_trgm(cursor):
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_archive_search_trgm ON investment_posts_archive "
+                "USING gin (search_text gin_trgm_ops)"
+            )
+        # 此时 investment_posts 还没有 is_valuable (migration 11), 视图由归档迁移 2 重建
+        self._create_pg_all_posts_view(
+            cursor, ", ".join(name for name, _ in ARCHIVE_COLUMNS if name != 'is_valuable')
+        )
+
+    def _create_pg_all_posts_view(self, cursor, columns=ARCHIVE_COLUMN_NAMES):
+        # CREATE OR REPLACE VIEW 不能在已有列之间插入新列, 先删除再创建
+        cursor.execute("DROP VIEW IF EXISTS all_posts")
+        cursor.execute(f'''
+            CREATE VIEW all_posts AS
+            SELECT {columns}, search_text FROM investment_posts
+            UNION ALL
+            SELECT {columns}, search_text FROM investment_posts_archive
+        ''')
+
+    def _migration_8(self, cursor):
+        """分析任务租约: claim_posts 写入 lease_owner / lease_expires, 过期后其他进程可以重新领取"""
+        self._add_column(cursor, "investment_posts", "lease_owner", "TEXT")
+        self._add_column(cursor, "investment_posts", "lease_expires", "BIGINT")
+
+    def _migration_9(self, cursor):
+        """AI 分析结果缓存, 键为 内容 hash + provider + model + prompt hash"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                prompt_hash TEXT,
+                result TEXT,
+                created_at BIGINT,
+                last_used_at BIGINT,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used_at)")
+
+    def _migration_10(self, cursor):
+        """post_simhash: 帖子内容的 SimHash 指纹, 按 4 段分别建索引用于查找近似重复"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS post_simhash (
+                post_id TEXT PRIMARY KEY,
+                simhash BIGINT,
+                band0 INTEGER,
+                band1 INTEGER,
+                band2 INTEGER,
+                band3 INTEGER
+            )
+        ''')
+        for band in range(4):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_post_simhash_band{band} ON post_simhash (band{band})")
+        self._rebuild_simhash(cursor)
+
+    def _migration_11(self, cursor):
+        """is_valuable: AI 判断的是否有投资价值, 用于训练本地预筛选模型 (prefilter.py)"""
+        self._add_column(cursor, "investment_posts", "is_valuable", "INTEGER")
+
+    def _migration_12(self, cursor):
+        """thread_pending: 完整评论还没拉取 (被推迟或失败) 的帖子, 之后的抓取轮次补抓"""
+        self._add_column(cursor, "investment_posts", "thread_pending", "INTEGER DEFAULT 0")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_thread_pending ON investment_posts (thread_pending)")
+
+    def _migration_13(self, cursor):
+        """crawl_state.gap: 增量抓取没有接上高水位线时留下的区间 (JSON), 之后的轮次续抓"""
+        self._add_column(cursor, "crawl_state", "gap", "TEXT")
+
+    def _migration_14(self, cursor):
+        """验证失败的帖子 (ticker 为 '无效数据') 之前被当作标的写入了 post_tickers"""
+        cursor.execute("DELETE FROM post_tickers WHERE raw_ticker = '无效数据'")
+
+    # (version, description, method name); 只追加, 不修改已发布的迁移
+    MIGRATIONS = [
+        (1, "legacy investment_posts columns", "_migration_1"),
+        (2, "create_ts epoch column and unanalyzed index", "_migration_2"),
+        (3, "content_hash column", "_migration_3"),
+        (4, "full-text search index", "_migration_4"),
+        (5, "post_tickers table", "_migration_5"),
+        (6, "compressed content columns", "_migration_6"),
+        (7, "archive table and all_posts view", "_migration_7"),
+        (8, "analysis lease columns", "_migration_8"),
+        (9, "analysis result cache", "_migration_9"),
+        (10, "simhash near-duplicate index", "_migration_10"),
+        (11, "is_valuable column", "_migration_11"),
+        (12, "thread_pending column", "_migration_12"),
+        (13, "crawl_state gap column", "_migration_13"),
+        (14, "drop invalid-post rows from post_tickers", "_migration_14"),
+    ]
+
+    def _archive_migration_1(self, cursor):
+        """SQLite 归档表、索引和全文索引 (可能在 ARCHIVE_DB_PATH 指定的文件里); PostgreSQL 已由 migration 7 创建"""
+        if self.use_postgres:
+            return
+        schema = self.archive_table.split('.')[0]
+        cursor.execute(_archive_table_sql(self.archive_table, "BLOB"))
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_archive_create_ts ON investment_posts_archive (create_ts)")
+        try:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.archive_fts} USING fts5(content, logic, ai_summary)")
+        except sqlite3.OperationalError:
+            pass
+
+    def _archive_migration_2(self, cursor):
+        """归档时保留 is_valuable, 恢复的帖子不丢失预筛选的训练标签"""
+        self._add_column(cursor, self.archive_table, "is_valuable", "INTEGER")
+        if self.use_postgres:
+            self._create_pg_all_posts_view(cursor)
+
+    # 归档表的迁移, 版本号记录在 archive_version_table (与归档表同库); 只追加
+    ARCHIVE_MIGRATIONS = [
+        (1, "archive table", "_archive_migration_1"),
+        (2, "is_valuable column", "_archive_migration_2"),
+    ]
+
+    def _schema_version(self, cursor, table="schema_version"):
+        cursor.execute(f"SELECT MAX(version) FROM {table}")
+        row = cursor.fetchone()
+        return (row[0] or 0) if row else 0
+
+    def _migrate(self, migrations=None, version_table="schema_version"):
+        """按版本号依次执行未应用的迁移, 每个迁移一个事务, 版本号写入 version_table"""
+        if migrations is None:
+            migrations = self.MIGRATIONS
+        with self.transaction() as cursor:
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {version_table} (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TEXT
+                )
+            ''')
+        with self.cursor() as cursor:
+            current = self._schema_version(cursor, version_table)
+        for version, description, method in migrations:
+            if version <= current:
+                continue
+            with self.transaction() as cursor:
+                # 加锁后重新读取版本, 避免多个进程同时迁移
+                if self.use_postgres:
+                    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('zsxq_schema_migration'))")
+                else:
+                    cursor.execute("BEGIN IMMEDIATE")
+                if self._schema_version(cursor, version_table) >= version:
+                    continue
+                getattr(self, method)(cursor)
+                cursor.execute(
+                    self._prepare_query(f"INSERT INTO {version_table} (version, description, applied_at) VALUES (?, ?, ?)"),
+                    (version, description, datetime.now().isoformat())
+                )
+            logger.info(f"Applied {version_table} migration {version}: {description}")
+
+    def _create_table(self):
+        try:
+            with self.transaction() as cursor:
+                query = '''
+                    CREATE TABLE IF NOT EXISTS investment_posts (
+                        id TEXT PRIMARY KEY,
+                        content TEXT,
+                        author TEXT,
+                        create_time TEXT,
+                        url TEXT,
+                        section_name TEXT,
+                        is_analyzed INTEGER DEFAULT 0,
+                        ticker TEXT,
+                        suggestion TEXT,
+                        logic TEXT,
+                        ai_summary TEXT,
+                        group_id TEXT,
+                        comments_count INTEGER,
+                        likes_count INTEGER
+                    )
+                '''
+                cursor.execute(self._prepare_query(query))
+                # 增量抓取的高水位线: 每个 group + 板块(scope/专栏) 最后抓到的 topic
+                cursor.execute(self._prepare_query('''
+                    CREATE TABLE IF NOT EXISTS crawl_state (
+                        group_id TEXT NOT NULL,
+                        section_key TEXT NOT NULL,
+                        last_create_time TEXT,
+                        last_topic_id TEXT,
+                        updated_at TEXT,
+                        PRIMARY KEY (group_id, section_key)
+                    )
+                '''))
+                # 历史回填的断点: 每个 group + 板块的翻页游标
+                cursor.execute(self._prepare_query('''
+                    CREATE TABLE IF NOT EXISTS backfill_state (
+                        group_id TEXT NOT NULL,
+                        section_key TEXT NOT NULL,
+                        next_cursor TEXT,
+                        pages INTEGER DEFAULT 0,
+                        items INTEGER DEFAULT 0,
+                        done INTEGER DEFAULT 0,
+                        updated_at TEXT,
+                        PRIMARY KEY (group_id, section_key)
+                    )
+                '''))
+                # 多星球抓取: 每个 group 的上次抓取时间, 用于按 group 单独调度
+                cursor.execute(self._prepare_query('''
+                    CREATE TABLE IF NOT EXISTS group_runs (
+                        group_id TEXT PRIMARY KEY,
+                        last_run_at TEXT,
+                        last_new_count INTEGER DEFAULT 0
+                    )
+                '''))
+                # 跨运行持久化的小型状态 (如抓取节奏), value 为 JSON
+                cursor.execute(self._prepare_query('''
+                    CREATE TABLE IF NOT EXISTS app_state (
+                        key TEXT PRIMARY KEY,
+                        value TEXT,
+                        updated_at TEXT
+                    )
+                '''))
+                # 已下载的文件附件, sha256 用于跳过内容重复的文件
+                cursor.execute(self._prepare_query('''
+                    CREATE TABLE IF NOT EXISTS attachments (
+                        file_id TEXT PRIMARY KEY,
+                        group_id TEXT,
+                        name TEXT,
+                        size BIGINT,
+                        sha256 TEXT,
+                        path TEXT,
+                        downloaded_at TEXT
+                    )
+                '''))
+                cursor.execute(self._prepare_query(
+                    "CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments (sha256)"
+                ))
         except Exception as e:
             logger.error(f"Error creating table: {e}")
-            conn.rollback()
             raise
-        finally:
-            conn.close()
 
-    def post_exists(self, post_id):
-        conn = self._get_conn()
-        try:
-            with conn:
-                cursor = conn.cursor()
-                query = "SELECT 1 FROM investment_posts WHERE id = ?"
-                cursor.execute(self._prepare_query(query), (post_id,))
-                return cursor.fetchone() is not None
-        finally:
-            conn.close()
+        self._migrate()
 
-    def save_post(self, post_id, content, author, create_time, url, section_name=None):
-        conn = self._get_conn()
-        try:
-            with conn:
-                cursor = conn.cursor()
+    def get_state(self, key):
+        """读取 app_state 中的 JSON 状态, 不存在时返回 None"""
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query("SELECT value FROM app_state WHERE key = ?"), (key,))
+            row = cursor.fetchone()
+            return json.loads(row[0]) if row and row[0] else None
+
+    def set_state(self, key, value):
+        with self.transaction() as cursor:
+            query = '''
+                INSERT INTO app_state (key, value, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value,
+                    updated_at = excluded.updated_at
+            '''
+            cursor.execute(self._prepare_query(query), (key, json.dumps(value), datetime.now().isoformat()))
+
+    def get_crawl_marks(self, group_id):
+        """读取 group 下所有板块的高水位线: {section_key: {'create_time': ..., 'topic_id': ..., 'gap': ...}}"""
+        with self.cursor() as cursor:
+            query = "SELECT section_key, last_create_time, last_topic_id, gap FROM crawl_state WHERE group_id = ?"
+            cursor.execute(self._prepare_query(query), (str(group_id),))
+            return {
+                section_key: {'create_time': create_time, 'topic_id': topic_id, 'gap': json.loads(gap) if gap else None}
+                for section_key, create_time, topic_id, gap in cursor.fetchall()
+                if create_time
+            }
+
+    def save_crawl_marks(self, group_id, marks):
+        """保存高水位线, 应在本轮抓取的帖子入库之后调用"""
+        if not marks:
+            return
+        with self.transaction() as cursor:
+            query = '''
+                INSERT INTO crawl_state (group_id, section_key, last_create_time, last_topic_id, gap, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (group_id, section_key) DO UPDATE SET
+                    last_create_time = excluded.last_create_time,
+                    last_topic_id = excluded.last_topic_id,
+                    gap = excluded.gap,
+                    updated_at = excluded.updated_at
+            '''
+            now = datetime.now().isoformat()
+            for section_key, mark in marks.items():
+                gap = json.dumps(mark['gap']) if mark.get('gap') else None
+                cursor.execute(self._prepare_query(query), (
+                    str(group_id), section_key, mark['create_time'], mark.get('topic_id'), gap, now
+                ))
+
+    def get_group_last_run(self, group_id):
+        """返回 group 上次抓取时间 (datetime), 从未抓取过时返回 None"""
+        with self.cursor() as cursor:
+            query = "SELECT last_run_at FROM group_runs WHERE group_id = ?"
+            cursor.execute(self._prepare_query(query), (str(group_id),))
+            row = cursor.fetchone()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def record_group_run(self, group_id, new_count):
+        with self.transaction() as cursor:
+            query = '''
+                INSERT INTO group_runs (group_id, last_run_at, last_new_count)
+                VALUES (?, ?, ?)
+                ON CONFLICT (group_id) DO UPDATE SET
+                    last_run_at = excluded.last_run_at,
+                    last_new_count = excluded.last_new_count
+            '''
+            cursor.execute(self._prepare_query(query), (str(group_id), datetime.now().isoformat(), new_count))
+
+    def _post_rows(self, posts, group_id=None):
+        """帖子 dict 转为 POST_COLUMNS 顺序的行, 同一批内重复的 id 只保留第一次出现的"""
+        rows = []
+        seen = set()
+        for post in posts:
+            if post['id'] in seen:
+                continue
+            seen.add(post['id'])
+            rows.append((
+                post['id'], *self.codec.encode(post['content']), content_hash(post['content']),
+                post.get('author'), post.get('create_time'),
+                parse_create_time(post.get('create_time')), post.get('url'),
+                post.get('section_name'), post.get('group_id') or group_id,
+                post.get('comments_count'), post.get('likes_count'), int(bool(post.get('thread_pending')))
+            ))
+        return rows
+
+    def _stored_hashes(self, cursor, ids, table="investment_posts", column="content_hash"):
+        """分块查询已存帖子的 content_hash (或其他列): {post_id: value}"""
+        stored = {}
+        for i in range(0, len(ids), BATCH_SIZE):
+            chunk = list(ids[i:i + BATCH_SIZE])
+            placeholders = ", ".join("?" for _ in chunk)
+            query = f"SELECT id, {column} FROM {table} WHERE id IN ({placeholders})"
+            cursor.execute(self._prepare_query(query), chunk)
+            stored.update(cursor.fetchall())
+        return stored
+
+    def _copy_posts(self, cursor, rows):
+        """PostgreSQL 大批量写入: COPY 到临时表再合并, 返回新插入的 id"""
+        columns = ", ".join(POST_COLUMNS)
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS investment_posts_stage "
+            "(LIKE investment_posts INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY investment_posts_stage ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO investment_posts ({columns}) "
+            f"SELECT {columns} FROM investment_posts_stage "
+            f"ON CONFLICT (id) DO NOTHING RETURNING id"
+        )
+        new_ids = {row[0] for row in cursor.fetchall()}
+        cursor.execute("DELETE FROM investment_posts_stage")
+        return new_ids
+
+    def save_posts_batch(self, posts, group_id=None):
+        """批量写入帖子, 已存在 (包括已归档) 的 id 保持不变 (INSERT ... ON CONFLICT DO NOTHING)
+
+        PostgreSQL 用 execute_values (超过 COPY_THRESHOLD 行时用 COPY) 一条语句写入, 通过 RETURNING 拿到新 id;
+        SQLite 先分块查出已存在的 id 再 executemany。返回新插入的帖子 id 列表, 保持输入顺序。
+        """
+        rows = self._post_rows(posts, group_id)
+        if not rows:
+            return []
+        columns = ", ".join(POST_COLUMNS)
+        with self.transaction() as cursor:
+            archived = self._stored_hashes(cursor, [row[0] for row in rows], self.archive_table)
+            rows = [row for row in rows if row[0] not in archived]
+            if not rows:
+                return []
+            if self.use_postgres:
+                if len(rows) >= COPY_THRESHOLD:
+                    inserted = self._copy_posts(cursor, rows)
+                else:
+                    query = f"INSERT INTO investment_posts ({columns}) VALUES %s ON CONFLICT (id) DO NOTHING RETURNING id"
+                    result = psycopg2.extras.execute_values(cursor, query, rows, page_size=BATCH_SIZE, fetch=True)
+                    inserted = {row[0] for row in result}
+                new_ids = [row[0] for row in rows if row[0] in inserted]
+            else:
+                existing = self._stored_hashes(cursor, [row[0] for row in rows])
+                rows = [row for row in rows if row[0] not in existing]
+                if rows:
+                    placeholders = ", ".join("?" for _ in POST_COLUMNS)
+                    query = f"INSERT INTO investment_posts ({columns}) VALUES ({placeholders}) ON CONFLICT (id) DO NOTHING"
+                    cursor.executemany(query, rows)
+                new_ids = [row[0] for row in rows]
+
+            contents = {post['id']: post['content'] for post in reversed(posts)}
+            self._index_simhash(cursor, [(post_id, contents[post_id]) for post_id in new_ids])
+            return new_ids
+
+    def get_post_counters(self, post_ids):
+        """批量读取已存帖子的评论数/点赞数: {post_id: (comments_count, likes_count)}"""
+        if not post_ids:
+            return {}
+        with self.cursor() as cursor:
+            placeholders = ", ".join("?" for _ in post_ids)
+            query = f"SELECT id, comments_count, likes_count FROM all_posts WHERE id IN ({placeholders})"
+            cursor.execute(self._prepare_query(query), list(post_ids))
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    def get_pending_threads(self, group_id, limit=30):
+        """标记了 thread_pending 的帖子 (最新的在前): [{'id', 'content', 'comments_count', 'likes_count'}]"""
+        query = '''
+            SELECT id, content, content_z, content_codec, comments_count, likes_count
+            FROM investment_posts WHERE thread_pending = 1 AND group_id = ?
+            ORDER BY create_ts DESC LIMIT ?
+        '''
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query(query), (str(group_id), limit))
+            return [
+                {'id': row[0], 'content': self.codec.decode(*row[1:4]), 'comments_count': row[4], 'likes_count': row[5]}
+                for row in cursor.fetchall()
+            ]
+
+    def update_post_threads(self, posts):
+        """批量更新评论有变化的帖子: 内容哈希变化时重置分析状态, 仅计数变化时只更新计数
+
+        写入新内容的帖子清除 thread_pending; 带 thread_pending 的帖子 (完整评论这轮没拉到) 只更新计数并打上标记。
+        """
+        if not posts:
+            return 0
+        with self.transaction() as cursor:
+            # 评论内容有变化 (或待补抓) 的已归档帖子移回主表, 重新进入分析队列
+            self._restore_archived(cursor, [
+                post['id'] for post in posts if post.get('content_changed') or post.get('thread_pending')
+            ])
+            content_updates = [
+                (*self.codec.encode(post['content']), content_hash(post['content']), content_hash(post['content']),
+                 post.get('comments_count'), post.get('likes_count'), post['id'])
+                for post in posts if post.get('content_changed')
+            ]
+            counter_updates = [
+                (post.get('comments_count'), post.get('likes_count'), post['id'])
+                for post in posts if not post.get('content_changed')
+            ]
+            if content_updates:
                 query = '''
-                    INSERT INTO investment_posts (id, content, author, create_time, url, section_name)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                    UPDATE investment_posts
+                    SET content = ?, content_z = ?, content_codec = ?, content_hash = ?,
+                        is_analyzed = CASE WHEN content_hash = ? THEN is_analyzed ELSE 0 END,
+                        comments_count = ?, likes_count = ?, thread_pending = 0
+                    WHERE id = ?
                 '''
-                cursor.execute(self._prepare_query(query), (post_id, content, author, create_time, url, section_name))
-                conn.commit()
-                return True
-        except (sqlite3.IntegrityError, psycopg2.IntegrityError, Exception):
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+                cursor.executemany(self._prepare_query(query), content_updates)
+                self._index_simhash(cursor, [(post['id'], post['content']) for post in posts if post.get('content_changed')])
+            if counter_updates:
+                for table in ("investment_posts", self.archive_table):
+                    query = f"UPDATE {table} SET comments_count = ?, likes_count = ? WHERE id = ?"
+                    cursor.executemany(self._prepare_query(query), counter_updates)
+            pending = [(post['id'],) for post in posts if post.get('thread_pending') and not post.get('content_changed')]
+            if pending:
+                cursor.executemany(
+                    self._prepare_query("UPDATE investment_posts SET thread_pending = 1 WHERE id = ?"), pending
+                )
+            return len(content_updates)
 
-    def get_unanalyzed_posts(self, limit=None):
-        """获取未分析的帖子,支持限制数量"""
-        conn = self._get_conn()
+    def get_post_content(self, post_id):
+        """读取并解压单个帖子的内容 (包括已归档的), 不存在时返回 None"""
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query("SELECT content, content_z, content_codec FROM all_posts WHERE id = ?"),
+                           (post_id,))
+            row = cursor.fetchone()
+            return self.codec.decode(*row) if row else None
+
+    def iter_unanalyzed_posts(self, batch_size=200):
+        """逐批读取全部未分析的帖子 (按 create_ts 倒序), 内存占用与积压的帖子数无关
+
+        扫描只读 id 和元数据: PostgreSQL 用服务端命名游标, SQLite 用单独的连接 fetchmany;
+        content 在产出该行时才用 get_post_content 单独读取解压。元素与 claim_posts 相同。
+        """
+        query = ("SELECT id, url, author, create_time, section_name "
+                 "FROM investment_posts WHERE is_analyzed = 0 ORDER BY create_ts DESC")
+        if self.use_postgres:
+            with self._connection() as conn:
+                cursor = conn.cursor(name=f"unanalyzed_{uuid.uuid4().hex[:8]}")
+                cursor.itersize = batch_size
+                try:
+                    cursor.execute(query)
+                    for row in cursor:
+                        yield (row[0], self.get_post_content(row[0])) + tuple(row[1:])
+                finally:
+                    cursor.close()
+                    if not conn.closed:
+                        conn.rollback()
+            return
+
+        # 不用线程共享的连接: 调用方边遍历边写库提交时不会影响这个读游标
+        conn = sqlite3.connect(self.db_path, timeout=30)
         try:
-            cursor = conn.cursor()
-            query = "SELECT id, content, url, author, create_time, section_name FROM investment_posts WHERE is_analyzed = 0 ORDER BY create_time DESC"
-            if limit:
-                query += f" LIMIT {limit}"
-            cursor.execute(self._prepare_query(query))
-            return cursor.fetchall()
+            cursor = conn.execute(query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield (row[0], self.get_post_content(row[0])) + tuple(row[1:])
         finally:
             conn.close()
-    
+
+    def claim_posts(self, owner, limit=10, lease_seconds=None):
+        """领取最多 limit 个未分析且未被租用 (或租约已过期) 的帖子, 租约 lease_seconds 秒
+
+        多个分析进程同时运行时每个帖子只会被一个进程领取:
+        PostgreSQL 用 FOR UPDATE SKIP LOCKED, SQLite 用单条 UPDATE ... RETURNING (写锁串行)。
+        owner 自己领取过的帖子 (包括租约已过期的) 不会再被它领取, release_posts 之后才可以,
+        所以循环领取时每个帖子只尝试一次, 每次最多读取 limit 行。
+        返回 [(id, content, url, author, create_time, section_name)]。
+        """
+        if lease_seconds is None:
+            lease_seconds = int(os.getenv("ANALYZE_LEASE_SECONDS", "600"))
+        now = int(time.time())
+        columns = "id, content, content_z, content_codec, url, author, create_time, section_name, create_ts"
+        with self.transaction() as cursor:
+            if self.use_postgres:
+                query = f'''
+                    WITH picked AS (
+                        SELECT id FROM investment_posts
+                        WHERE is_analyzed = 0 AND (lease_expires IS NULL OR lease_expires < ?)
+                          AND (lease_owner IS NULL OR lease_owner <> ?)
+                        ORDER BY create_ts DESC LIMIT ?
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE investment_posts AS p SET lease_owner = ?, lease_expires = ?
+                    FROM picked WHERE p.id = picked.id
+                    RETURNING {", ".join("p." + column for column in columns.split(", "))}
+                '''
+                cursor.execute(self._prepare_query(query), (now, owner, limit, owner, now + lease_seconds))
+                rows = cursor.fetchall()
+            elif sqlite3.sqlite_version_info >= (3, 35):
+                query = f'''
+                    UPDATE investment_posts SET lease_owner = ?, lease_expires = ?
+                    WHERE id IN (
+                        SELECT id FROM investment_posts
+                        WHERE is_analyzed = 0 AND (lease_expires IS NULL OR lease_expires < ?)
+                          AND (lease_owner IS NULL OR lease_owner <> ?)
+                        ORDER BY create_ts DESC LIMIT ?
+                    )
+                    RETURNING {columns}
+                '''
+                cursor.execute(query, (owner, now + lease_seconds, now, owner, limit))
+                rows = cursor.fetchall()
+            else:
+                # 旧版 SQLite 没有 RETURNING: 先拿写锁再查询和更新
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(
+                    f"SELECT {columns} FROM investment_posts "
+                    "WHERE is_analyzed = 0 AND (lease_expires IS NULL OR lease_expires < ?) "
+                    "AND (lease_owner IS NULL OR lease_owner <> ?) "
+                    "ORDER BY create_ts DESC LIMIT ?",
+                    (now, owner, limit)
+                )
+                rows = cursor.fetchall()
+                cursor.executemany(
+                    "UPDATE investment_posts SET lease_owner = ?, lease_expires = ? WHERE id = ?",
+                    [(owner, now + lease_seconds, row[0]) for row in rows]
+                )
+        # RETURNING 不保证顺序
+        rows.sort(key=lambda row: row[8] or 0, reverse=True)
+        return [(row[0], self.codec.decode(*row[1:4])) + tuple(row[4:8]) for row in rows]
+
+    def release_posts(self, owner, post_ids=None):
+        """释放 owner 持有的租约 (默认全部), 未分析完的帖子可以立即被重新领取"""
+        with self.transaction() as cursor:
+            query = "UPDATE investment_posts SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ? AND is_analyzed = 0"
+            if post_ids is None:
+                cursor.execute(self._prepare_query(query), (owner,))
+            else:
+                cursor.executemany(self._prepare_query(query + " AND id = ?"), [(owner, pid) for pid in post_ids])
+            return cursor.rowcount
+
     def get_unanalyzed_count(self):
         """获取未分析帖子的数量"""
-        conn = self._get_conn()
-        try:
-            cursor = conn.cursor()
+        with self.cursor() as cursor:
             query = "SELECT COUNT(*) FROM investment_posts WHERE is_analyzed = 0"
             cursor.execute(self._prepare_query(query))
             return cursor.fetchone()[0]
-        finally:
-            conn.close()
 
-    def update_analysis(self, post_id, ticker, suggestion, logic, ai_summary):
-        conn = self._get_conn()
+    def _save_post_tickers(self, cursor, post_id, ticker, suggestion, create_ts=None):
+        """用分析结果重写该帖子在 post_tickers 中的行"""
+        cursor.execute(self._prepare_query("DELETE FROM post_tickers WHERE post_id = ?"), (post_id,))
+        rows = [
+            (post_id, canonical, raw, call, create_ts)
+            for canonical, raw, call in default_normalizer().extract(ticker, suggestion)
+        ]
+        if rows:
+            query = "INSERT INTO post_tickers (post_id, ticker, raw_ticker, suggestion, create_ts) VALUES (?, ?, ?, ?, ?)"
+            cursor.executemany(self._prepare_query(query), rows)
+        return len(rows)
+
+    def _rebuild_post_tickers(self, cursor):
+        cursor.execute("DELETE FROM post_tickers")
+        # migration 5 时还没有归档表
+        table = "all_posts" if self._archive_ready else "investment_posts"
+        cursor.execute(
+            f"SELECT id, ticker, suggestion, create_ts FROM {table} "
+            "WHERE is_analyzed = 1 AND ticker IS NOT NULL"
+        )
+        count = sum(self._save_post_tickers(cursor, *row) for row in cursor.fetchall())
+        logger.info(f"Rebuilt post_tickers: {count} rows")
+
+    def rebuild_post_tickers(self):
+        """按当前别名表重建 post_tickers (修改 TICKER_ALIASES_FILE 后使用)"""
+        with self.transaction() as cursor:
+            self._rebuild_post_tickers(cursor)
+
+    def update_analysis(self, post_id, ticker, suggestion, logic, ai_summary, is_valuable=None):
+        if is_valuable is not None:
+            is_valuable = int(bool(is_valuable))
+        with self.transaction() as cursor:
+            query = '''
+                UPDATE investment_posts
+                SET ticker = ?, suggestion = ?, logic = ?, ai_summary = ?, is_analyzed = 1, is_valuable = ?,
+                    lease_owner = NULL, lease_expires = NULL
+                WHERE id = ?
+            '''
+            cursor.execute(self._prepare_query(query), (ticker, suggestion, logic, ai_summary, is_valuable, post_id))
+            cursor.execute(self._prepare_query("SELECT create_ts FROM investment_posts WHERE id = ?"), (post_id,))
+            row = cursor.fetchone()
+            self._save_post_tickers(cursor, post_id, ticker, suggestion, row[0] if row else None)
+
+    def get_prefilter_samples(self, limit=5000, exclude_logic=None):
+        """最近已分析帖子的 [(post_id, content, 是否有价值)], 用于训练/评估本地预筛选模型
+
+        只使用有 is_valuable 的帖子 (该列加入之前分析的没有标签);
+        logic 等于 exclude_logic 的帖子 (预筛选自己跳过的) 不参与训练。
+        """
+        query = '''
+            SELECT p.id, p.content, p.content_z, p.content_codec, p.is_valuable
+            FROM all_posts p
+            WHERE p.is_analyzed = 1 AND p.is_valuable IS NOT NULL AND p.logic IS DISTINCT FROM ?
+            ORDER BY p.create_ts DESC LIMIT ?
+        '''
+        if not self.use_postgres:
+            query = query.replace("IS DISTINCT FROM", "IS NOT")
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query(query), (exclude_logic, limit))
+            return [
+                (row[0], self.codec.decode(*row[1:4]), bool(row[4]))
+                for row in cursor.fetchall()
+            ]
+
+    def get_ticker_calls(self, ticker, since=None, limit=20):
+        """某个标的最新的观点 (标的名称先按别名表归一), 按时间倒序
+
+        返回 dict 列表: post_id, ticker, raw_ticker, suggestion, create_time, author, url, ai_summary。
+        """
+        canonical = default_normalizer().normalize(ticker)
+        if not canonical:
+            return []
+        query = '''
+            SELECT t.post_id, t.ticker, t.raw_ticker, t.suggestion, p.create_time, p.author, p.url, p.ai_summary
+            FROM post_tickers t JOIN all_posts p ON p.id = t.post_id
+            WHERE t.ticker = ?
+        '''
+        params = [canonical]
+        if since is not None:
+            query += " AND t.create_ts >= ?"
+            params.append(int(since.timestamp()))
+        query += " ORDER BY t.create_ts DESC LIMIT ?"
+        params.append(limit)
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query(query), params)
+            columns = ('post_id', 'ticker', 'raw_ticker', 'suggestion', 'create_time', 'author', 'url', 'ai_summary')
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _index_simhash(self, cursor, posts):
+        """写入/更新 [(post_id, content)] 的 SimHash 指纹; 内容太短的帖子不建指纹"""
+        rows = []
+        stale = []
+        for post_id, content in posts:
+            value = simhash(search_tokens(content))
+            if value is None:
+                stale.append((post_id,))
+                continue
+            rows.append((post_id, to_signed(value), *bands(value)))
+        if stale:
+            cursor.executemany(self._prepare_query("DELETE FROM post_simhash WHERE post_id = ?"), stale)
+        if rows:
+            query = '''
+                INSERT INTO post_simhash (post_id, simhash, band0, band1, band2, band3)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (post_id) DO UPDATE SET
+                    simhash = excluded.simhash,
+                    band0 = excluded.band0,
+                    band1 = excluded.band1,
+                    band2 = excluded.band2,
+                    band3 = excluded.band3
+            '''
+            cursor.executemany(self._prepare_query(query), rows)
+
+    def _rebuild_simhash(self, cursor):
+        cursor.execute("DELETE FROM post_simhash")
+        tables = ["investment_posts"]
+        if self.use_postgres or self._has_fts(cursor, self.archive_table):
+            tables.append(self.archive_table)
+        # 单独的游标分批读取, 避免一次载入所有帖子
+        reader = cursor.connection.cursor()
         try:
-            with conn:
-                cursor = conn.cursor()
-                query = '''
-                    UPDATE investment_posts
-                    SET ticker = ?, suggestion = ?, logic = ?, ai_summary = ?, is_analyzed = 1
-                    WHERE id = ?
-                '''
-                cursor.execute(self._prepare_query(query), (ticker, suggestion, logic, ai_summary, post_id))
-                conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
+            for table in tables:
+                reader.execute(f"SELECT id, content, content_z, content_codec FROM {table}")
+                while True:
+                    chunk = reader.fetchmany(BATCH_SIZE)
+                    if not chunk:
+                        break
+                    self._index_simhash(cursor, [(row[0], self.codec.decode(*row[1:4])) for row in chunk])
         finally:
-            conn.close()
+            reader.close()
 
-    def update_post_content(self, post_id, content):
-        """更新帖子内容并重置分析状态"""
-        conn = self._get_conn()
-        try:
-            with conn: # Assuming transaction managed by context or autocommit behavior if configured, but _create_table needed explicit. Let's be safe and adhere to consistent pattern.
-                cursor = conn.cursor()
+    def rebuild_simhash_index(self):
+        with self.transaction() as cursor:
+            self._rebuild_simhash(cursor)
+
+    def find_near_duplicate(self, post_id, content=None):
+        """查找与该帖子近似重复 (SimHash 海明距离 <= SIMHASH_MAX_DISTANCE) 且已分析的帖子
+
+        返回距离最近的一个: {'post_id', 'distance', 'ticker', 'suggestion', 'logic', 'ai_summary', 'is_valuable'},
+        没有时返回 None。
+        """
+        if self.simhash_max_distance <= 0:
+            return None
+        with self.cursor() as cursor:
+            cursor.execute(self._prepare_query("SELECT simhash FROM post_simhash WHERE post_id = ?"), (post_id,))
+            row = cursor.fetchone()
+            if row:
+                value = to_unsigned(row[0])
+            else:
+                value = simhash(search_tokens(content)) if content is not None else None
+            if value is None:
+                return None
+            query = '''
+                SELECT s.post_id, s.simhash, p.ticker, p.suggestion, p.logic, p.ai_summary, p.is_valuable
+                FROM post_simhash s JOIN all_posts p ON p.id = s.post_id
+                WHERE (s.band0 = ? OR s.band1 = ? OR s.band2 = ? OR s.band3 = ?)
+                  AND s.post_id <> ? AND p.is_analyzed = 1 AND p.ticker <> '无效数据'
+            '''
+            cursor.execute(self._prepare_query(query), (*bands(value), post_id))
+            best = None
+            for dup_id, dup_hash, ticker, suggestion, logic, ai_summary, is_valuable in cursor.fetchall():
+                distance = hamming_distance(value, to_unsigned(dup_hash))
+                if distance <= self.simhash_max_distance and (best is None or distance < best['distance']):
+                    best = {'post_id': dup_id, 'distance': distance, 'ticker': ticker,
+                            'suggestion': suggestion, 'logic': logic, 'ai_summary': ai_summary,
+                            'is_valuable': is_valuable}
+            return best
+
+    def group_near_duplicates(self, posts):
+        """同一批待分析的 [(post_id, content)] 中互为近似重复的帖子: {post_id: 该组代表的 post_id}
+
+        代表是每组中最先出现的帖子, 只有它需要请求 AI, 其余沿用它的结果。指纹优先取 post_simhash 中已存的。
+        """
+        if self.simhash_max_distance <= 0 or len(posts) < 2:
+            return {}
+        ids = [post_id for post_id, _ in posts]
+        stored = {}
+        with self.cursor() as cursor:
+            for i in range(0, len(ids), BATCH_SIZE):
+                chunk = ids[i:i + BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                query = f"SELECT post_id, simhash FROM post_simhash WHERE post_id IN ({placeholders})"
+                cursor.execute(self._prepare_query(query), chunk)
+                stored.update(cursor.fetchall())
+        values = []
+        for post_id, content in posts:
+            value = stored.get(post_id)
+            values.append((post_id, to_unsigned(value) if value is not None else simhash(search_tokens(content))))
+        return group_near_duplicates(values, self.simhash_max_distance)
+
+    def get_backfill_checkpoint(self, group_id, section_key):
+        """读取回填断点, 不存在时返回 None"""
+        with self.cursor() as cursor:
+            query = "SELECT next_cursor, pages, items, done FROM backfill_state WHERE group_id = ? AND section_key = ?"
+            cursor.execute(self._prepare_query(query), (str(group_id), section_key))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return {'next_cursor': row[0], 'pages': row[1], 'items': row[2], 'done': bool(row[3])}
+
+    def reset_backfill_checkpoints(self, group_id):
+        with self.transaction() as cursor:
+            cursor.execute(self._prepare_query("DELETE FROM backfill_state WHERE group_id = ?"), (str(group_id),))
+
+    def upsert_posts(self, posts, group_id=None):
+        """按内容哈希写入一批帖子
+
+        - 新帖子: 插入
+        - 已存在且内容哈希变化: 更新内容并重置分析状态
+        - 已存在且内容未变: 只刷新评论数/点赞数, 不重新进入分析队列
+        - 列表中评论被截断 (comments_count > embedded_comments) 的帖子只带部分评论, 不覆盖已存内容:
+          评论数有变化时标记 thread_pending, 由 crawl.py 拉取完整评论; 新帖子带标记插入
+        返回 {'new': n, 'changed': n, 'pending': n, 'unchanged': n}。
+        """
+        rows = {}
+        for post in posts:
+            rows.setdefault(post['id'], post)
+        truncated = {post_id for post_id, post in rows.items()
+                     if 'embedded_comments' in post and (post.get('comments_count') or 0) > post['embedded_comments']}
+        with self.transaction() as cursor:
+            stored = self._stored_hashes(cursor, list(rows))
+            archived = self._stored_hashes(cursor, [post_id for post_id in rows if post_id not in stored],
+                                           self.archive_table)
+            counters = {}
+            for table in ("investment_posts", self.archive_table):
+                counters.update(self._stored_hashes(
+                    cursor, [post_id for post_id in truncated if post_id in stored or post_id in archived],
+                    table, column="comments_count"
+                ))
+
+            def thread_changed(post_id):
+                if post_id in truncated:
+                    return counters.get(post_id) != rows[post_id].get('comments_count')
+                return content_hash(rows[post_id]['content']) != (stored.get(post_id) or archived.get(post_id))
+
+            # 内容有变化的已归档帖子先移回主表
+            revived = [post_id for post_id in archived if thread_changed(post_id)]
+            self._restore_archived(cursor, revived)
+            for post_id in revived:
+                stored[post_id] = archived.pop(post_id)
+
+            changed = []
+            pending = []
+            unchanged = []
+            archived_unchanged = [
+                (group_id, rows[post_id].get('comments_count'), rows[post_id].get('likes_count'), post_id)
+                for post_id in archived
+            ]
+            for post_id, post in rows.items():
+                if post_id not in stored:
+                    continue
+                counts = (group_id, post.get('comments_count'), post.get('likes_count'), post_id)
+                if post_id in truncated:
+                    (pending if thread_changed(post_id) else unchanged).append(counts)
+                    continue
+                digest = content_hash(post['content'])
+                if digest == stored[post_id]:
+                    unchanged.append(counts)
+                else:
+                    changed.append((*self.codec.encode(post['content']), digest, group_id,
+                                    post.get('comments_count'), post.get('likes_count'), post_id))
+            if changed:
                 query = '''
                     UPDATE investment_posts
-                    SET content = ?, is_analyzed = 0 
+                    SET content = ?, content_z = ?, content_codec = ?, content_hash = ?,
+                        group_id = COALESCE(group_id, ?),
+                        comments_count = ?, likes_count = ?, is_analyzed = 0
                     WHERE id = ?
                 '''
-                cursor.execute(self._prepare_query(query), (content, post_id))
-                conn.commit()
-                return cursor.rowcount > 0
-        except Exception:
-            conn.rollback()
-            raise
+                cursor.executemany(self._prepare_query(query), changed)
+                self._index_simhash(cursor, [(row[-1], rows[row[-1]]['content']) for row in changed])
+            for table, updates, extra in (("investment_posts", unchanged, ""),
+                                          ("investment_posts", pending, ", thread_pending = 1"),
+                                          (self.archive_table, archived_unchanged, "")):
+                if updates:
+                    query = f'''
+                        UPDATE {table}
+                        SET group_id = COALESCE(group_id, ?), comments_count = ?, likes_count = ?{extra}
+                        WHERE id = ?
+                    '''
+                    cursor.executemany(self._prepare_query(query), updates)
+            new_ids = self.save_posts_batch(
+                [dict(post, thread_pending=True) if post_id in truncated else post
+                 for post_id, post in rows.items() if post_id not in stored and post_id not in archived],
+                group_id=group_id
+            )
+        return {'new': len(new_ids), 'changed': len(changed), 'pending': len(pending),
+                'unchanged': len(unchanged) + len(archived_unchanged)}
+
+    def save_backfill_page(self, group_id, section_key, posts, checkpoint):
+        """在同一个事务中批量写入一页帖子 (upsert_posts) 并推进回填断点, 返回 upsert_posts 的计数"""
+        with self.transaction() as cursor:
+            counts = self.upsert_posts(posts, group_id=str(group_id))
+
+            query = '''
+                INSERT INTO backfill_state (group_id, section_key, next_cursor, pages, items, done, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (group_id, section_key) DO UPDATE SET
+                    next_cursor = excluded.next_cursor,
+                    pages = excluded.pages,
+                    items = excluded.items,
+                    done = excluded.done,
+                    updated_at = excluded.updated_at
+            '''
+            cursor.execute(self._prepare_query(query), (
+                str(group_id), section_key, checkpoint['next_cursor'], checkpoint['pages'],
+                checkpoint['items'], int(checkpoint['done']), datetime.now().isoformat()
+            ))
+            return counts
+
+    def _index_archived(self, cursor, ids=None):
+        """把归档表中的行写入归档 FTS 索引 (ids 为 None 时写入全部)"""
+        where = ""
+        if ids is not None:
+            where = f"WHERE id IN ({', '.join('?' for _ in ids)})"
+        cursor.execute(f'''
+            INSERT INTO {self.archive_fts} (rowid, content, logic, ai_summary)
+            SELECT rowid, search_text(post_content(content, content_z, content_codec)),
+                   search_text(logic), search_text(ai_summary)
+            FROM {self.archive_table} {where}
+        ''', list(ids or []))
+
+    def _delete_archived(self, cursor, ids):
+        placeholders = ", ".join("?" for _ in ids)
+        if not self.use_postgres and self._has_fts(cursor, self.archive_fts):
+            cursor.execute(
+                f"DELETE FROM {self.archive_fts} WHERE rowid IN "
+                f"(SELECT rowid FROM {self.archive_table} WHERE id IN ({placeholders}))", ids
+            )
+        cursor.execute(self._prepare_query(f"DELETE FROM {self.archive_table} WHERE id IN ({placeholders})"), ids)
+
+    def _restore_archived(self, cursor, ids):
+        """把已归档的帖子移回主表 (内容有变化、需要重新分析时)"""
+        archived = list(self._stored_hashes(cursor, list(ids), self.archive_table)) if ids else []
+        for i in range(0, len(archived), BATCH_SIZE):
+            chunk = archived[i:i + BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(self._prepare_query(
+                f"INSERT INTO investment_posts ({ARCHIVE_COLUMN_NAMES}) "
+                f"SELECT {ARCHIVE_COLUMN_NAMES} FROM {self.archive_table} WHERE id IN ({placeholders})"
+            ), chunk)
+            self._delete_archived(cursor, chunk)
+        if archived:
+            logger.info(f"Restored {len(archived)} archived posts with changed content")
+        return archived
+
+    def archive_old_posts(self, days=None, batch_size=BATCH_SIZE):
+        """把已分析且发布超过 days 天 (默认 ARCHIVE_AFTER_DAYS, 0 表示不归档) 的帖子移到归档表, 返回移动的帖子数
+
+        每批先复制到归档表并提交, 再从主表删除: SQLite 的归档放在单独文件时跨文件事务不是原子的,
+        这样中途失败最多留下重复行 (下次运行会清理), 不会丢数据。
+        """
+        days = self.archive_after_days if days is None else days
+        if not days or days <= 0:
+            return 0
+        cutoff = int(time.time()) - days * 86400
+        total = 0
+        while True:
+            with self.transaction() as cursor:
+                cursor.execute(self._prepare_query(
+                    "SELECT id FROM investment_posts WHERE is_analyzed = 1 AND create_ts < ? LIMIT ?"
+                ), (cutoff, batch_size))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                placeholders = ", ".join("?" for _ in ids)
+                self._delete_archived(cursor, ids)
+                cursor.execute(self._prepare_query(
+                    f"INSERT INTO {self.archive_table} ({ARCHIVE_COLUMN_NAMES}, archived_at) "
+                    f"SELECT {ARCHIVE_COLUMN_NAMES}, ? FROM investment_posts WHERE id IN ({placeholders})"
+                ), [datetime.now().isoformat()] + ids)
+                if not self.use_postgres and self._has_fts(cursor, self.archive_fts):
+                    self._index_archived(cursor, ids)
+            with self.transaction() as cursor:
+                cursor.execute(self._prepare_query(f"DELETE FROM investment_posts WHERE id IN ({placeholders})"), ids)
+            total += len(ids)
+        if total:
+            logger.info(f"Archived {total} analyzed posts older than {days} days")
+        return total
+
+    def _has_trgm(self, cursor):
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+    def _has_fts(self, cursor, table="posts_fts"):
+        schema, _, name = table.rpartition('.')
+        master = f"{schema}.sqlite_master" if schema else "sqlite_master"
+        cursor.execute(f"SELECT 1 FROM {master} WHERE type = 'table' AND name = ?", (name,))
+        return cursor.fetchone() is not None
+
+    def rebuild_search_index(self):
+        """重建 SQLite 全文索引 (如 VACUUM 改变了 rowid 之后); PostgreSQL 的生成列无需重建"""
+        if self.use_postgres:
+            return
+        with self.transaction() as cursor:
+            if self._has_fts(cursor):
+                self._rebuild_fts(cursor)
+            if self._has_fts(cursor, self.archive_fts):
+                cursor.execute(f"DELETE FROM {self.archive_fts}")
+                self._index_archived(cursor)
+
+    def search_posts(self, query, since=None, until=None, group_id=None, limit=20):
+        """全文搜索 content / logic / ai_summary
+
+        query 中空格分隔的每个词都必须出现 (AND); since / until 为 datetime, 按 create_ts 过滤。
+        SQLite 按 bm25 排序 (logic / ai_summary 权重更高), PostgreSQL 按 pg_trgm 的 word_similarity 排序。
+        返回 dict 列表: id, create_time, author, url, section_name, ticker, ai_summary, snippet, score。
+        """
+        terms = [term for term in query.split() if search_tokens(term)]
+        if not terms:
+            return []
+        filters = []
+        params = []
+        if since is not None:
+            filters.append("p.create_ts >= ?")
+            params.append(int(since.timestamp()))
+        if until is not None:
+            filters.append("p.create_ts < ?")
+            params.append(int(until.timestamp()))
+        if group_id is not None:
+            filters.append("p.group_id = ?")
+            params.append(str(group_id))
+
+        columns = ("p.id, p.create_time, p.author, p.url, p.section_name, p.ticker, p.ai_summary, "
+                   "p.content, p.content_z, p.content_codec")
+        with self.cursor() as cursor:
+            # 单个汉字没有对应的 bigram, 这种查询退回 LIKE
+            use_fts = (not self.use_postgres and self._has_fts(cursor)
+                       and all(len(token) > 1 or not _CJK_RE.match(token)
+                               for term in terms for token in search_tokens(term)))
+            if use_fts:
+                # 主表和归档表各有一个 FTS 索引, 分别查询后按 bm25 合并
+                match = " ".join('"' + _search_text(term) + '"' for term in terms)
+                rows = []
+                sources = [("posts_fts", "investment_posts")]
+                if self._has_fts(cursor, self.archive_fts):
+                    sources.append((self.archive_fts, self.archive_table))
+                for fts, table in sources:
+                    # MATCH 和 bm25() 需要用不带别名、不带 schema 的表名
+                    name = fts.rpartition('.')[2]
+                    where = " AND ".join([f"{name} MATCH ?"] + filters)
+                    sql = f'''
+                        SELECT {columns}, bm25({name}, 1.0, 2.0, 2.0) AS score
+                        FROM {fts} JOIN {table} p ON p.rowid = {name}.rowid
+                        WHERE {where}
+                        ORDER BY score, p.create_ts DESC
+                        LIMIT ?
+                    '''
+                    cursor.execute(sql, [match] + params + [limit])
+                    rows.extend(cursor.fetchall())
+                rows = sorted(rows, key=lambda row: row[10])[:limit]
+            else:
+                like_filters = []
+                like_params = []
+                for term in terms:
+                    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                    if self.use_postgres:
+                        like_filters.append("p.search_text ILIKE ?")
+                        like_params.append(pattern)
+                    else:
+                        like_filters.append(
+                            "(post_content(p.content, p.content_z, p.content_codec) LIKE ? ESCAPE '\\' "
+                            "OR p.logic LIKE ? ESCAPE '\\' OR p.ai_summary LIKE ? ESCAPE '\\')"
+                        )
+                        like_params.extend([pattern] * 3)
+                where = " AND ".join(like_filters + filters)
+                if self.use_postgres and self._has_trgm(cursor):
+                    score = "word_similarity(?, p.search_text)"
+                    order = "score DESC, p.create_ts DESC"
+                    score_params = [query]
+                else:
+                    score, order, score_params = "0", "p.create_ts DESC", []
+                sql = f"SELECT {columns}, {score} AS score FROM all_posts p WHERE {where} ORDER BY {order} LIMIT ?"
+                cursor.execute(self._prepare_query(sql), score_params + like_params + params + [limit])
+                rows = cursor.fetchall()
+
+        return [
+            {
+                'id': row[0], 'create_time': row[1], 'author': row[2], 'url': row[3], 'section_name': row[4],
+                'ticker': row[5], 'ai_summary': row[6], 'snippet': _snippet(self.codec.decode(*row[7:10]), terms),
+                'score': row[10]
+            }
+            for row in rows
+        ]
+
+    def _load_compression_dict(self, dict_id):
+        """读取压缩字典; 用独立连接, 因为可能在触发器里的 post_content() 中被调用"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+            return bytes(row[0]) if row else None
         finally:
             conn.close()
+
+    def _latest_compression_dict(self, codec):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT MAX(id) FROM compression_dicts WHERE codec = ?", (codec,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def train_compression_dict(self, sample_size=2000):
+        """用最近的长帖子训练共享字典并设为当前字典, 返回字典 id (样本不足时返回 None)"""
+        if not self.codec.enabled:
+            return None
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT content, content_z, content_codec FROM investment_posts "
+                "WHERE LENGTH(CAST(content AS BLOB)) >= ? OR content_z IS NOT NULL ORDER BY create_ts DESC LIMIT ?",
+                (self.codec.min_bytes, sample_size)
+            )
+            samples = [self.codec.decode(*row) for row in cursor.fetchall()]
+        data = train_dictionary(self.codec.codec, samples)
+        if not data:
+            logger.warning("Not enough content to train a compression dictionary")
+            return None
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO compression_dicts (codec, data, created_at) VALUES (?, ?, ?)",
+                (self.codec.codec, data, datetime.now().isoformat())
+            )
+            dict_id = cursor.lastrowid
+        self.codec.use_dict(dict_id, data)
+        logger.info(f"Trained {self.codec.codec} dictionary {dict_id} ({len(data)} bytes) from {len(samples)} posts")
+        return dict_id
+
+    def compress_existing_posts(self, batch_size=500):
+        """压缩尚未压缩的长帖子, 返回 (压缩行数, 原始字节数, 压缩后字节数)"""
+        if not self.codec.enabled:
+            return 0, 0, 0
+        total = raw_bytes = packed_bytes = 0
+        last_rowid = 0
+        while True:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    "SELECT rowid, id, content FROM investment_posts "
+                    "WHERE rowid > ? AND content_z IS NULL AND LENGTH(CAST(content AS BLOB)) >= ? "
+                    "ORDER BY rowid LIMIT ?",
+                    (last_rowid, self.codec.min_bytes, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1][0]
+                updates = []
+                for _, post_id, content in rows:
+                    encoded = self.codec.encode(content)
+                    if encoded[1] is not None:
+                        updates.append((*encoded, post_id))
+                        raw_bytes += len(content.encode('utf-8'))
+                        packed_bytes += len(encoded[1])
+                cursor.executemany(
+                    "UPDATE investment_posts SET content = ?, content_z = ?, content_codec = ? WHERE id = ?", updates
+                )
+                total += len(updates)
+            logger.info(f"Compressed {total} posts so far")
+        return total, raw_bytes, packed_bytes
+
+    def get_attachment(self, file_id=None, sha256=None):
+        """按 file_id 或 sha256 查找已下载的附件, 返回 dict 或 None"""
+        with self.cursor() as cursor:
+            if file_id is not None:
+                query = "SELECT file_id, name, size, sha256, path FROM attachments WHERE file_id = ?"
+                cursor.execute(self._prepare_query(query), (str(file_id),))
+            else:
+                query = "SELECT file_id, name, size, sha256, path FROM attachments WHERE sha256 = ? LIMIT 1"
+                cursor.execute(self._prepare_query(query), (sha256,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return {'file_id': row[0], 'name': row[1], 'size': row[2], 'sha256': row[3], 'path': row[4]}
+
+    def save_attachment(self, file_id, group_id, name, size, sha256, path):
+        with self.transaction() as cursor:
+            query = '''
+                INSERT INTO attachments (file_id, group_id, name, size, sha256, path, downloaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_id) DO UPDATE SET
+                    size = excluded.size,
+                    sha256 = excluded.sha256,
+                    path = excluded.path,
+                    downloaded_at = excluded.downloaded_at
+            '''
+            cursor.execute(self._prepare_query(query), (
+                str(file_id), str(group_id), name, size, sha256, path, datetime.now().isoformat()
+            ))
+
+    def get_cached_analysis(self, cache_key):
+        """读取缓存的分析结果 (dict), 不存在或超过 ANALYSIS_CACHE_TTL_DAYS 时返回 None; 命中时记录命中次数"""
+        now = int(time.time())
+        with self.transaction() as cursor:
+            query = "SELECT result, created_at FROM analysis_cache WHERE cache_key = ?"
+            cursor.execute(self._prepare_query(query), (cache_key,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            if self.analysis_cache_ttl_days > 0 and (row[1] or 0) < now - self.analysis_cache_ttl_days * 86400:
+                return None
+            query = "UPDATE analysis_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?"
+            cursor.execute(self._prepare_query(query), (now, cache_key))
+            return json.loads(row[0])
+
+    def save_cached_analysis(self, cache_key, provider, model, prompt_hash, result):
+        now = int(time.time())
+        with self.transaction() as cursor:
+            query = '''
+                INSERT INTO analysis_cache (cache_key, provider, model, prompt_hash, result, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    result = excluded.result,
+                    created_at = excluded.created_at,
+                    last_used_at = excluded.last_used_at
+            '''
+            cursor.execute(self._prepare_query(query), (
+                cache_key, provider, model, prompt_hash, json.dumps(result, ensure_ascii=False), now, now
+            ))
+
+    def evict_analysis_cache(self):
+        """删除超过 TTL 的缓存, 条目数超过 ANALYSIS_CACHE_MAX_ENTRIES 时再删除最久未使用的, 返回删除数"""
+        deleted = 0
+        with self.transaction() as cursor:
+            if self.analysis_cache_ttl_days > 0:
+                cutoff = int(time.time()) - self.analysis_cache_ttl_days * 86400
+                cursor.execute(self._prepare_query("DELETE FROM analysis_cache WHERE created_at < ?"), (cutoff,))
+                deleted += cursor.rowcount
+            if self.analysis_cache_max_entries > 0:
+                cursor.execute("SELECT COUNT(*) FROM analysis_cache")
+                excess = cursor.fetchone()[0] - self.analysis_cache_max_entries
+                if excess > 0:
+                    query = '''
+                        DELETE FROM analysis_cache WHERE cache_key IN (
+                            SELECT cache_key FROM analysis_cache ORDER BY last_used_at LIMIT ?
+                        )
+                    '''
+                    cursor.execute(self._prepare_query(query), (excess,))
+                    deleted += cursor.rowcount
+        if deleted:
+            logger.info(f"Evicted {deleted} analysis cache entries")
+        return deleted
@@ -4,10 +4,12 @@ import logging
 import schedule
 from dotenv import load_dotenv
 
-from database import Database
+from database import Database, worker_id
 from crawler import ZsxqCrawler
 from analyzer import AIAnalyzer
 from notifier import Notifier
+from crawl import crawl_groups, PACER_STATE_KEY
+from prefilter import load_filter, PREFILTER_LOGIC
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +24,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ZsxqMain")
 
+# Posts claimed per round; keep it small so the lease (ANALYZE_LEASE_SECONDS) outlives the round
+CLAIM_BATCH = 5
 
 
 def run_task():
@@ -43,65 +47,74 @@ def run_task():
         return
 
     db = Database()
-    notifier = Notifier(ding_url, ding_secret)
-    crawler = ZsxqCrawler(cookie, notifier)
-    analyzer = AIAnalyzer(ai_api_key, ai_base_url, provider=ai_provider, gemini_key=gemini_key, gemini_model=gemini_model, star_owner_name=star_owner_name)
-
-    # 动态获取 group_id
-    group_id = crawler.resolve_group_id()
+    crawler = None
+    try:
+        notifier = Notifier(ding_url, ding_secret)
+        crawler = ZsxqCrawler(cookie, notifier)
+        crawler.pacer.load_state(db.get_state(PACER_STATE_KEY))
+        analyzer = AIAnalyzer(ai_api_key, ai_base_url, provider=ai_provider, gemini_key=gemini_key, gemini_model=gemini_model, star_owner_name=star_owner_name, cache=db)
+
+        # 动态获取 group_id (支持多个星球)
+        group_ids = crawler.resolve_group_ids()
     
-    if not group_id:
-        logger.error("无法获取 group_id，程序退出")
-        return
-
-    logger.info("Starting crawl cycle...")
+        if not group_ids:
+            logger.error("无法获取 group_id，程序退出")
+            return
 
-    # 2. Fetch data from different parts
-    fetched_data = []
-    
-    # A. Fetch Group Topics
-    logger.info("Fetching Group topics (all & digests)...")
-    fetched_data.extend(crawler.get_group_topics(group_id, scope='digests'))
-    fetched_data.extend(crawler.get_group_topics(group_id, scope='all'))
-    
-    # B. Fetch Dynamic Columns
-    logger.info("Discovering and fetching Column articles...")
-    columns = crawler.get_group_columns(group_id)
-    for col in columns:
-        col_id = col.get('column_id')
-        col_name = col.get('name')
-        logger.info(f"Fetching articles from column: {col_name} ({col_id})")
-        fetched_data.extend(crawler.get_column_articles(group_id, col_id, col_name))
-    
-    # C. Fetch Files
-    logger.info("Fetching Group files...")
-    fetched_data.extend(crawler.get_group_files(group_id))
+        # 2-3. Fetch every group in parallel and store new posts
+        new_posts_count = crawl_groups(db, crawler, group_ids)
+        db.set_state(PACER_STATE_KEY, crawler.pacer.state())
     
-    # D. Fetch Questions
-    logger.info("Fetching Group questions...")
-    fetched_data.extend(crawler.get_group_questions(group_id))
-
-    # 3. Store new posts
-    new_posts_count = 0
-    for post in fetched_data:
-        if not db.post_exists(post['id']):
-            db.save_post(
-                post['id'], 
-                post['content'], 
-                post['author'], 
-                post['create_time'], 
-                post['url'],
-                post.get('section_name')
-            )
-            new_posts_count += 1
-    
-    logger.info(f"Cycle complete. Found {len(fetched_data)} raw items, {new_posts_count} new.")
-
-    # 4. Analyze unanalyzed posts
-    unanalyzed = db.get_unanalyzed_posts()
+        logger.info(f"Cycle complete. {new_posts_count} new posts across {len(group_ids)} group(s).")
+
+        # 4. Analyze unanalyzed posts, claimed a few at a time so that a concurrent
+        # analyze.py run never picks up the same post
+        owner = worker_id()
+        prefilter = load_filter(db)
+        try:
+            while True:
+                # claim_posts never hands an owner its own posts back (even after the
+                # lease expires), so each post gets one attempt per run and the loop ends
+                claimed = db.claim_posts(owner, limit=CLAIM_BATCH)
+                if not claimed:
+                    break
+                analyze_claimed(db, analyzer, notifier, claimed, request_delay, prefilter)
+        finally:
+            # Failed posts stay leased until here, then the next run retries them
+            db.release_posts(owner)
+
+        if analyzer.cache is not None:
+            logger.info(f"Analysis cache: {analyzer.cache_hits} hits, {analyzer.cache_misses} misses")
+            db.evict_analysis_cache()
+
+        # 6. Move old analyzed posts to the archive table (ARCHIVE_AFTER_DAYS)
+        db.archive_old_posts()
+    finally:
+        # The scheduler calls run_task every cycle; close this run's sessions and pools.
+        # crawler.close() also writes responses recorded with ZSXQ_RECORD_FILE
+        if crawler is not None:
+            crawler.close()
+        db.close()
+
+def analyze_claimed(db, analyzer, notifier, unanalyzed, request_delay, prefilter=None):
     for pid, content, url, author, create_time, section_name in unanalyzed:
+        duplicate = db.find_near_duplicate(pid, content)
+        if duplicate:
+            # Reposts of an analyzed post inherit its result; the original was already notified
+            logger.info(f"Post {pid} is a near-duplicate of {duplicate['post_id']}, reusing its analysis.")
+            db.update_analysis(pid, duplicate['ticker'], duplicate['suggestion'], duplicate['logic'], duplicate['ai_summary'],
+                               is_valuable=duplicate['is_valuable'])
+            continue
+
+        if prefilter is not None:
+            candidate, reason = prefilter.is_candidate(content)
+            if not candidate:
+                logger.info(f"Post {pid} skipped by the local prefilter ({reason}).")
+                db.update_analysis(pid, "无", "无", PREFILTER_LOGIC, "本地预筛选判定为非投资内容, 未经 AI 分析", is_valuable=False)
+                continue
+
         logger.info(f"Analyzing post {pid}...")
-        analysis = analyzer.analyze_post(content)
+        analysis, from_cache = analyzer.analyze_post_cached(content)
         
         if analysis:
             # Update DB
@@ -110,7 +123,8 @@ def run_task():
                 analysis.get('ticker', '无'),
                 analysis.get('suggestion', '无'),
                 analysis.get('logic', '无'),
-                analysis.get('ai_summary', '无')
+                analysis.get('ai_summary', '无'),
+                is_valuable=analysis.get('is_valuable')
             )
             
             # 5. Notify if valuable
@@ -129,6 +143,11 @@ def run_task():
         else:
             logger.warning(f"Failed to analyze post {pid}")
         
+        if from_cache:
+            # Served from analysis_cache without an API call, nothing to rate-limit
+            logger.info(f"Analysis of post {pid} served from cache.")
+            continue
+
         # Add delay to respect rate limits (especially for Gemini Free Tier)
         logger.info(f"Analysis complete. Sleeping for {request_delay}s to respect rate limits...")
         time.sleep(request_delay)
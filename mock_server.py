@@ -0,0 +1,316 @@
+"""
+知识星球 API 本地替身服务器
+
+实现 crawler.py 用到的接口 (groups / topics (all, digests, by_column, q_and_a) / columns /
+files / topic comments / 文件下载), 用于在没有真实 Cookie 的情况下回归测试和测量抓取性能。
+
+数据来源:
+- 录制: 以 ZSXQ_RECORD_FILE=fixtures.json 运行 crawl.py, 真实响应会被合并写入该文件
+- 合成: --synthetic-topics N 生成随机帖子
+
+用法:
+    python mock_server.py --fixtures fixtures.json --port 8765 --latency 80 --error-429 0.05
+    ZSXQ_API_BASE=http://127.0.0.1:8765 python crawl.py
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+BEIJING = timezone(timedelta(hours=8))
+
+
+class FixtureStore:
+    """按 group 保存 topics/专栏/文件/评论, 既用于录制也用于回放"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {'groups': [], 'topics': {}, 'columns': {}, 'column_topics': {}, 'files': {}, 'comments': {}}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data.update(json.load(f))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=1)
+        logger.info(f"Fixtures saved to {self.path}")
+
+    def record(self, url, payload):
+        """把一次真实 API 响应合并进 fixtures"""
+        parsed = urlparse(url)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        resp = payload.get('resp') or payload.get('resp_data') or {}
+        with self._lock:
+            if parsed.path == '/v2/groups':
+                known = {str(g.get('group_id')) for g in self.data['groups']}
+                self.data['groups'].extend(g for g in resp.get('groups', []) if str(g.get('group_id')) not in known)
+                return
+
+            match = re.fullmatch(r'/v2/groups/(\w+)/(topics|columns|files)', parsed.path)
+            if match:
+                group_id, kind = match.groups()
+                if kind == 'topics':
+                    topics = self.data['topics'].setdefault(group_id, {})
+                    for topic in resp.get('topics', []):
+                        topics[str(topic.get('topic_id'))] = topic
+                    if query.get('scope') == 'by_column':
+                        ids = self.data['column_topics'].setdefault(group_id, {}).setdefault(query.get('column_id'), [])
+                        ids.extend(str(t.get('topic_id')) for t in resp.get('topics', []) if str(t.get('topic_id')) not in ids)
+                elif kind == 'columns':
+                    self.data['columns'][group_id] = resp.get('columns', [])
+                else:
+                    files = {str(f.get('file_id')): f for f in self.data['files'].get(group_id, [])}
+                    files.update({str(f.get('file_id')): f for f in resp.get('files', [])})
+                    self.data['files'][group_id] = list(files.values())
+                return
+
+            match = re.fullmatch(r'/v2/topics/(\w+)/comments', parsed.path)
+            if match:
+                comments = {str(c.get('comment_id')): c for c in self.data['comments'].get(match.group(1), [])}
+                comments.update({str(c.get('comment_id')): c for c in resp.get('comments', [])})
+                self.data['comments'][match.group(1)] = list(comments.values())
+
+    def list_topics(self, group_id, scope, column_id=None, end_time=None, count=20):
+        topics = list(self.data['topics'].get(group_id, {}).values())
+        if scope == 'digests':
+            topics = [t for t in topics if t.get('digested')]
+        elif scope == 'q_and_a':
+            topics = [t for t in topics if t.get('type') == 'q&a']
+        elif scope == 'by_column':
+            ids = set(self.data['column_topics'].get(group_id, {}).get(str(column_id), []))
+            topics = [t for t in topics if str(t.get('topic_id')) in ids]
+        if end_time:
+            topics = [t for t in topics if t.get('create_time', '') <= end_time]
+        topics.sort(key=lambda t: t.get('create_time', ''), reverse=True)
+        return topics[:count]
+
+    def list_comments(self, topic_id, begin_time=None, count=30):
+        comments = sorted(self.data['comments'].get(str(topic_id), []), key=lambda c: c.get('create_time', ''))
+        if begin_time:
+            comments = [c for c in comments if c.get('create_time', '') >= begin_time]
+        return comments[:count]
+
+    @classmethod
+    def synthetic(cls, groups=1, topics=200, columns=3, seed=0):
+        """生成合成数据: 帖子时间向过去均匀分布, 部分为精华/问答/专栏, 带评论"""
+        rng = random.Random(seed)
+        store = cls()
+        now = datetime.now(BEIJING)
+        authors = ['星主', '球友A', '球友B', '球友C']
+        assets = ['黄金', '宁德时代', '纳斯达克', '沪深300', '比特币', '招商银行']
+        comment_id = 1
+        for g in range(groups):
+            group_id = str(10000 + g)
+            store.data['groups'].append({'group_id': int(group_id), 'name': f'测试星球{g + 1}', 'type': 'pay'})
+            store.data['columns'][group_id] = [
+                {'column_id': int(f"{group_id}{c}"), 'name': f'专栏{c + 1}'} for c in range(columns)
+            ]
+            group_topics = {}
+            for i in range(topics):
+                topic_id = str(int(group_id) * 100000 + i)
+                created = now - timedelta(minutes=37 * i + rng.randint(0, 30))
+                create_time = created.strftime('%Y-%m-%dT%H:%M:%S.') + f"{created.microsecond // 1000:03d}+0800"
+                text = f"关于{rng.choice(assets)}的看法: " + "行情分析内容。" * rng.randint(5, 60)
+                n_comments = rng.choice([0, 0, 1, 2, 5, 12, 40])
+                comments = []
+                for c in range(n_comments):
+                    c_time = created + timedelta(minutes=c + 1)
+                    comments.append({
+                        'comment_id': comment_id,
+                        'create_time': c_time.strftime('%Y-%m-%dT%H:%M:%S.') + f"{c_time.microsecond // 1000:03d}+0800",
+                        'owner': {'name': rng.choice(authors)},
+                        'text': f"评论 {c + 1}: 同意/补充观点"
+                    })
+                    comment_id += 1
+                store.data['comments'][topic_id] = comments
+                topic = {
+                    'topic_id': int(topic_id),
+                    'create_time': create_time,
+                    'digested': rng.random() < 0.15,
+                    'comments_count': n_comments,
+                    'likes_count': rng.randint(0, 50),
+                    'show_comments': comments[:3]
+                }
+                if rng.random() < 0.15:
+                    topic['type'] = 'q&a'
+                    topic['question_answer'] = {
+                        'question': {'text': f"请问{rng.choice(assets)}怎么看?"},
+                        'answer': {'text': text, 'owner': {'name': '星主'}}
+                    }
+                else:
+                    topic['type'] = 'talk'
+                    topic['talk'] = {'text': text, 'owner': {'name': rng.choice(authors)}}
+                group_topics[topic_id] = topic
+                if columns and rng.random() < 0.2:
+                    column_id = f"{group_id}{rng.randrange(columns)}"
+                    store.data['column_topics'].setdefault(group_id, {}).setdefault(column_id, []).append(topic_id)
+            store.data['topics'][group_id] = group_topics
+            store.data['files'][group_id] = [
+                {'file_id': int(f"{group_id}{f}"), 'name': f'研报{f + 1}.pdf', 'size': 1024 * (f + 1),
+                 'owner': {'name': '星主'}, 'create_time': now.strftime('%Y-%m-%dT%H:%M:%S.000+0800')}
+                for f in range(5)
+            ]
+        return store
+
+
+class MockZsxqHandler(BaseHTTPRequestHandler):
+    store = None
+    latency = 0.0
+    latency_jitter = 0.0
+    error_rates = {}
+    stats = {'requests': 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _ok(self, resp_data):
+        self._send(200, {'succeeded': True, 'resp_data': resp_data})
+
+    def do_GET(self):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+        if self.latency or self.latency_jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.latency_jitter, self.latency_jitter)))
+
+        for status, rate in self.error_rates.items():
+            if rate and random.random() < rate:
+                with self.stats_lock:
+                    self.stats[status] = self.stats.get(status, 0) + 1
+                return self._send(status, {'succeeded': False, 'code': status})
+
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        count = int(query.get('count', 20))
+
+        if parsed.path == '/v2/groups':
+            return self._ok({'groups': self.store.data['groups']})
+
+        match = re.fullmatch(r'/v2/groups/(\w+)/topics', parsed.path)
+        if match:
+            topics = self.store.list_topics(match.group(1), query.get('scope', 'all'), query.get('column_id'),
+                                            query.get('end_time'), count)
+            return self._ok({'topics': topics})
+
+        match = re.fullmatch(r'/v2/groups/(\w+)/columns', parsed.path)
+        if match:
+            return self._ok({'columns': self.store.data['columns'].get(match.group(1), [])})
+
+        match = re.fullmatch(r'/v2/groups/(\w+)/files', parsed.path)
+        if match:
+            files = sorted(self.store.data['files'].get(match.group(1), []),
+                           key=lambda f: f.get('create_time', ''), reverse=True)
+            return self._ok({'files': files[:count]})
+
+        match = re.fullmatch(r'/v2/topics/(\w+)/comments', parsed.path)
+        if match:
+            return self._ok({'comments': self.store.list_comments(match.group(1), query.get('begin_time'), count)})
+
+        match = re.fullmatch(r'/v2/files/(\w+)/download_url', parsed.path)
+        if match:
+            host, port = self.server.server_address[:2]
+            return self._ok({'download_url': f"http://{host}:{port}/download/{match.group(1)}"})
+
+        match = re.fullmatch(r'/download/(\w+)', parsed.path)
+        if match:
+            return self._send_file(match.group(1))
+
+        self._send(404, {'succeeded': False, 'code': 404})
+
+    def _send_file(self, file_id):
+        """返回确定性的文件内容, 支持 Range 断点续传"""
+        meta = next((f for files in self.store.data['files'].values() for f in files
+                     if str(f.get('file_id')) == file_id), None)
+        if meta is None:
+            return self._send(404, {'succeeded': False, 'code': 404})
+        size = int(meta.get('size') or 0)
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+            if start >= size:
+                self.send_response(416)
+                self.end_headers()
+                return
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size - start))
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        pattern = (file_id.encode() * 64)[:64]
+        position = start
+        while position < size:
+            chunk_end = min(size, position + 65536)
+            self.wfile.write(bytes(pattern[i % 64] for i in range(position, chunk_end)))
+            position = chunk_end
+
+
+def serve(store, host='127.0.0.1', port=8765, latency=0.0, latency_jitter=0.0, error_rates=None):
+    """启动替身服务器 (阻塞); 返回前打印请求统计"""
+    handler = type('Handler', (MockZsxqHandler,), {
+        'store': store,
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'error_rates': error_rates or {},
+        'stats': {'requests': 0},
+        'stats_lock': threading.Lock()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info(f"Mock zsxq API listening on http://{host}:{port} "
+                f"({sum(len(t) for t in store.data['topics'].values())} topics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Served {handler.stats}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="知识星球 API 本地替身服务器")
+    parser.add_argument('--fixtures', help="录制的 fixtures JSON 文件 (ZSXQ_RECORD_FILE 生成)")
+    parser.add_argument('--synthetic-topics', type=int, default=200, help="未指定 fixtures 时每个星球生成的帖子数")
+    parser.add_argument('--synthetic-groups', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的固定延迟(毫秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延迟的随机抖动(毫秒)")
+    parser.add_argument('--error-429', type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument('--error-401', type=float, default=0.0, help="返回 401 的概率")
+    parser.add_argument('--error-500', type=float, default=0.0, help="返回 500 的概率")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        store = FixtureStore(args.fixtures)
+    else:
+        store = FixtureStore.synthetic(groups=args.synthetic_groups, topics=args.synthetic_topics, seed=args.seed)
+
+    serve(store, args.host, args.port, latency=args.latency / 1000, latency_jitter=args.jitter / 1000,
+          error_rates={429: args.error_429, 401: args.error_401, 500: args.error_500})
@@ -0,0 +1,79 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePacer:
+    """AIMD 请求节奏控制器
+
+    所有请求在发出前调用 acquire() 按当前速率排队, 请求结束后调用 record() 反馈结果:
+    - 成功且延迟正常: 速率加性增加 (每秒 +increase_step 个请求), 直到 max_rate
+    - 429 / 5xx / 连接错误: 速率乘性下降 (乘以 decrease_factor), 429 还会暂停一段冷却时间
+    - 延迟超过 latency_target: 视为拥塞信号, 速率轻度下降
+
+    速率和冷却状态通过 state() / load_state() 在多次运行之间持久化。
+    """
+
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None, increase_step=None,
+                 decrease_factor=0.5, latency_target=None, cooldown=30.0):
+        self.min_rate = min_rate or float(os.getenv("ZSXQ_PACER_MIN_RATE", "0.1"))
+        if max_rate is None:
+            min_interval = float(os.getenv("ZSXQ_MIN_REQUEST_INTERVAL", "0.2"))
+            max_rate = 1.0 / min_interval if min_interval > 0 else 20.0
+        self.max_rate = max_rate
+        self.increase_step = increase_step or float(os.getenv("ZSXQ_PACER_INCREASE_STEP", "0.05"))
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target or float(os.getenv("ZSXQ_PACER_LATENCY_TARGET", "3.0"))
+        self.cooldown = cooldown
+        self.rate = self._clamp(initial_rate or float(os.getenv("ZSXQ_PACER_INITIAL_RATE", "1.0")))
+        self.cooldown_until = 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _clamp(self, rate):
+        return max(self.min_rate, min(self.max_rate, rate))
+
+    def acquire(self):
+        """阻塞直到按当前速率轮到本次请求"""
+        with self._lock:
+            now = time.monotonic()
+            cooldown_left = self.cooldown_until - time.time()
+            start = max(now + max(0.0, cooldown_left), self._next_slot)
+            self._next_slot = start + 1.0 / self.rate
+        wait_time = start - now
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def record(self, status, latency, retry_after=None):
+        """反馈一次请求的结果; status 为 HTTP 状态码, 连接错误时为 None"""
+        with self._lock:
+            old_rate = self.rate
+            if status == 429:
+                self.rate = self._clamp(self.rate * self.decrease_factor)
+                pause = retry_after if retry_after else self.cooldown
+                self.cooldown_until = max(self.cooldown_until, time.time() + pause)
+            elif status is None or status >= 500:
+                self.rate = self._clamp(self.rate * self.decrease_factor)
+            elif latency > self.latency_target:
+                self.rate = self._clamp(self.rate * 0.9)
+            elif status < 400:
+                self.rate = self._clamp(self.rate + self.increase_step)
+
+            if self.rate < old_rate:
+                logger.warning(f"Pacer slowing down to {self.rate:.2f} req/s "
+                               f"(status={status}, latency={latency:.2f}s)")
+
+    def state(self):
+        with self._lock:
+            return {'rate': self.rate, 'cooldown_until': self.cooldown_until}
+
+    def load_state(self, state):
+        if not state:
+            return
+        with self._lock:
+            self.rate = self._clamp(float(state.get('rate', self.rate)))
+            self.cooldown_until = float(state.get('cooldown_until', 0.0))
+        logger.info(f"Pacer resumed at {self.rate:.2f} req/s")
@@ -0,0 +1,207 @@
+import os
+import math
+import zlib
+import logging
+import argparse
+from collections import Counter
+from dotenv import load_dotenv
+
+from database import Database, search_tokens
+from tickers import default_normalizer
+
+logger = logging.getLogger(__name__)
+
+# 预筛选跳过的帖子写入的 logic, 训练时排除这些帖子 (它们的标签不是 AI 给的)
+PREFILTER_LOGIC = "本地预筛选: 非投资内容"
+
+# 出现任意一个即视为候选, 一定交给 AI 分析
+INVESTMENT_KEYWORDS = [
+    '买入', '卖出', '加仓', '减仓', '建仓', '清仓', '持仓', '仓位', '止损', '止盈', '抄底', '逃顶',
+    '看多', '看空', '做多', '做空', '估值', '市盈率', '市值', '财报', '业绩', '营收', '利润', '分红',
+    '股价', '股票', '基金', '债券', '期货', '期权', '指数', '板块', '行情', '大盘', '牛市', '熊市',
+    '降息', '加息', '美联储', '通胀', '汇率', '收益率', '涨停', '跌停', '回调', '突破', '支撑', '压力位',
+]
+
+# 词表太大时只保留出现次数最多的词
+MAX_VOCABULARY = 50000
+
+
+class RelevanceFilter:
+    """
+    Local pre-filter deciding whether a post is worth an LLM request.
+
+    A post is a candidate when it mentions a known ticker alias (tickers.py) or
+    an investment keyword. Otherwise a multinomial naive Bayes model trained on
+    our own is_valuable history scores it, and posts whose probability of being
+    valuable is below `threshold` are skipped. Without enough labeled history
+    every post is a candidate.
+    """
+
+    def __init__(self, threshold=0.05, min_samples=200):
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.trained = False
+        self.aliases = [alias for alias in default_normalizer().lookup if len(alias) >= 2]
+        self.keywords = INVESTMENT_KEYWORDS
+
+    def dictionary_match(self, content):
+        """命中的标的别名或投资关键词, 没有时返回 None"""
+        text = (content or '').lower()
+        words = set(search_tokens(text))
+        for alias in self.aliases:
+            # 英文/数字别名按整词匹配 (避免 "oil" 命中 "toilet"), 中文按子串
+            if (alias in words) if alias.isascii() else (alias in text):
+                return alias
+        for keyword in self.keywords:
+            if keyword in text:
+                return keyword
+        return None
+
+    def fit(self, samples):
+        """samples: [(content, 是否有价值)]; 两类样本都足够时才启用模型"""
+        labels = Counter(bool(label) for _, label in samples)
+        if len(samples) < self.min_samples or min(labels[True], labels[False]) < self.min_samples // 10:
+            logger.info(f"Prefilter not trained: {labels[True]} valuable / {labels[False]} other samples "
+                        f"(need {self.min_samples} total)")
+            self.trained = False
+            return self
+
+        counts = {True: Counter(), False: Counter()}
+        for content, label in samples:
+            # 每个词在一篇帖子里只计一次, 长帖子不会压过短帖子
+            counts[bool(label)].update(set(search_tokens(content)))
+        vocabulary = [word for word, _ in (counts[True] + counts[False]).most_common(MAX_VOCABULARY)]
+        self.vocabulary = set(vocabulary)
+        self.log_prior = {label: math.log(labels[label] / len(samples)) for label in (True, False)}
+        self.log_likelihood = {}
+        for label in (True, False):
+            total = sum(counts[label][word] for word in vocabulary) + len(vocabulary)
+            self.log_likelihood[label] = {word: math.log((counts[label][word] + 1) / total) for word in vocabulary}
+        self.trained = True
+        logger.info(f"Prefilter trained on {len(samples)} posts ({labels[True]} valuable), "
+                    f"{len(self.vocabulary)} terms")
+        return self
+
+    def probability(self, content):
+        """模型估计的有价值概率; 未训练时返回 1.0"""
+        if not self.trained:
+            return 1.0
+        scores = {}
+        for label in (True, False):
+            likelihood = self.log_likelihood[label]
+            scores[label] = self.log_prior[label] + sum(
+                likelihood[word] for word in set(search_tokens(content)) if word in self.vocabulary
+            )
+        diff = scores[False] - scores[True]
+        return 1.0 / (1.0 + math.exp(min(diff, 700)))
+
+    def is_candidate(self, content):
+        """返回 (是否交给 AI, 原因)"""
+        match = self.dictionary_match(content)
+        if match:
+            return True, f"dictionary match: {match}"
+        probability = self.probability(content)
+        if probability >= self.threshold:
+            return True, f"model p={probability:.3f}"
+        return False, f"model p={probability:.3f} < {self.threshold}"
+
+
+def load_filter(db):
+    """按环境变量创建并训练预筛选器, 未启用 (PREFILTER=false) 时返回 None"""
+    if os.getenv("PREFILTER", "false").lower() != "true":
+        return None
+    prefilter = RelevanceFilter(
+        threshold=float(os.getenv("PREFILTER_THRESHOLD", "0.05")),
+        min_samples=int(os.getenv("PREFILTER_MIN_SAMPLES", "200"))
+    )
+    samples = db.get_prefilter_samples(
+        limit=int(os.getenv("PREFILTER_TRAIN_SIZE", "5000")), exclude_logic=PREFILTER_LOGIC
+    )
+    return prefilter.fit([(content, label) for _, content, label in samples])
+
+
+def _is_holdout(post_id):
+    # 按 id 固定划分, 每次评估使用同一批测试样本
+    return zlib.crc32(str(post_id).encode('utf-8')) % 5 == 0
+
+
+def evaluate(samples, thresholds, min_samples=200):
+    """用 80% 历史训练、20% 评估, 返回每个阈值的 (threshold, precision, recall, skip_rate, n)
+
+    precision / recall 以"有价值"为正类: recall 低说明有价值的帖子被误跳过。
+    """
+    train = [(content, label) for post_id, content, label in samples if not _is_holdout(post_id)]
+    test = [(content, label) for post_id, content, label in samples if _is_holdout(post_id)]
+    prefilter = RelevanceFilter(min_samples=min_samples).fit(train)
+    if not prefilter.trained or not test:
+        return []
+    scored = [(prefilter.dictionary_match(content) is not None, prefilter.probability(content), label)
+              for content, label in test]
+    results = []
+    for threshold in thresholds:
+        tp = fp = fn = tn = 0
+        for matched, probability, label in scored:
+            candidate = matched or probability >= threshold
+            if candidate and label:
+                tp += 1
+            elif candidate:
+                fp += 1
+            elif label:
+                fn += 1
+            else:
+                tn += 1
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        results.append((threshold, precision, recall, (fn + tn) / len(scored), len(scored)))
+    return results
+
+
+def backlog_skips(db, prefilter):
+    """逐个扫描未分析的积压帖子, 返回 (会被跳过的数量, 总数)"""
+    skipped = total = 0
+    for _, content, *_ in db.iter_unanalyzed_posts():
+        total += 1
+        if not prefilter.is_candidate(content or '')[0]:
+            skipped += 1
+    return skipped, total
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="用已分析的历史帖子评估本地预筛选的 precision / recall")
+    parser.add_argument("--samples", type=int, default=int(os.getenv("PREFILTER_TRAIN_SIZE", "5000")),
+                        help="使用最近 N 个已分析帖子 (默认 PREFILTER_TRAIN_SIZE 或 5000)")
+    parser.add_argument("--thresholds", default="0.01,0.02,0.05,0.1,0.2,0.3",
+                        help="逗号分隔的概率阈值 (默认 0.01,0.02,0.05,0.1,0.2,0.3)")
+    parser.add_argument("--backlog", action="store_true",
+                        help="再统计按 PREFILTER_THRESHOLD 当前未分析的积压帖子中会被跳过的数量")
+    args = parser.parse_args()
+
+    logging.getLogger("database").setLevel(logging.WARNING)
+    db = Database()
+    samples = db.get_prefilter_samples(limit=args.samples, exclude_logic=PREFILTER_LOGIC)
+    valuable = sum(1 for _, _, label in samples if label)
+    print(f"Labeled history: {len(samples)} posts, {valuable} valuable")
+
+    thresholds = [float(value) for value in args.thresholds.split(",")]
+    results = evaluate(samples, thresholds, min_samples=int(os.getenv("PREFILTER_MIN_SAMPLES", "200")))
+    if not results:
+        print("Not enough labeled history to train the prefilter.")
+        return
+    print(f"Held-out posts: {results[0][4]}")
+    print(f"{'threshold':>10} {'precision':>10} {'recall':>8} {'skipped':>8}")
+    for threshold, precision, recall, skip_rate, _ in results:
+        print(f"{threshold:>10.2f} {precision:>10.1%} {recall:>8.1%} {skip_rate:>8.1%}")
+
+    if args.backlog:
+        prefilter = RelevanceFilter(
+            threshold=float(os.getenv("PREFILTER_THRESHOLD", "0.05")),
+            min_samples=int(os.getenv("PREFILTER_MIN_SAMPLES", "200"))
+        ).fit([(content, label) for _, content, label in samples])
+        skipped, total = backlog_skips(db, prefilter)
+        print(f"Unanalyzed backlog: {total} posts, {skipped} would be skipped "
+              f"at threshold {prefilter.threshold}")
+
+
+if __name__ == "__main__":
+    main()
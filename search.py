@@ -0,0 +1,71 @@
+import argparse
+import logging
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from database import Database
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全文搜索已保存的帖子 (内容 / 投资逻辑 / AI 摘要)")
+    parser.add_argument("query", nargs="?", help="搜索词, 空格分隔的多个词须同时出现, 如: 宁德时代 储能")
+    parser.add_argument("--ticker", help="按标的查询最新观点 (支持别名/代码, 如: gold, 300750)")
+    parser.add_argument("--days", type=int, help="只搜索最近 N 天的帖子")
+    parser.add_argument("--since", help="起始日期 YYYY-MM-DD")
+    parser.add_argument("--until", help="截止日期 YYYY-MM-DD (不含)")
+    parser.add_argument("--group", help="只搜索指定星球的帖子")
+    parser.add_argument("--limit", type=int, default=20, help="最多返回条数 (默认 20)")
+    parser.add_argument("--rebuild", action="store_true", help="重建 SQLite 全文索引和标的表")
+    args = parser.parse_args()
+
+    if not args.query and not args.ticker and not args.rebuild:
+        parser.error("query or --ticker is required")
+
+    logging.getLogger("database").setLevel(logging.WARNING)
+    db = Database()
+    if args.rebuild:
+        db.rebuild_search_index()
+        db.rebuild_post_tickers()
+        print("Search index rebuilt.")
+        if not args.query and not args.ticker:
+            return
+
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    if args.days:
+        since = datetime.now() - timedelta(days=args.days)
+    until = datetime.strptime(args.until, "%Y-%m-%d") if args.until else None
+
+    if args.ticker:
+        calls = db.get_ticker_calls(args.ticker, since=since, limit=args.limit)
+        if not calls:
+            print("No calls found for this ticker.")
+            return
+        for idx, call in enumerate(calls, 1):
+            print(f"[{idx}] {call['create_time'] or ''} {call['author'] or ''} {call['ticker']}: {call['suggestion'] or '无'}")
+            if call['ai_summary']:
+                print(f"    AI: {call['ai_summary']}")
+            print(f"    {call['url']}")
+        return
+
+    results = db.search_posts(args.query, since=since, until=until, group_id=args.group, limit=args.limit)
+    if not results:
+        print("No matching posts.")
+        return
+
+    for idx, post in enumerate(results, 1):
+        header = f"[{idx}] {post['create_time'] or ''} {post['author'] or ''}"
+        if post['section_name']:
+            header += f" ({post['section_name']})"
+        if post['ticker']:
+            header += f" [{post['ticker']}]"
+        print(header)
+        print(f"    {post['snippet']}")
+        if post['ai_summary']:
+            print(f"    AI: {post['ai_summary']}")
+        print(f"    {post['url']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import hashlib
+from collections import Counter
+
+BITS = 64
+# 64 位指纹分成 4 段, 每段 16 位: 海明距离 <= 3 的两个指纹至少有一段完全相同,
+# 按段建索引即可找出候选, 不需要和所有帖子逐个比较
+BANDS = 4
+BAND_BITS = BITS // BANDS
+# 特征太少时指纹不稳定 (短文本很容易互相"相似"), 不建指纹
+MIN_FEATURES = 16
+
+_MASK = (1 << BITS) - 1
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(features):
+    """特征 (如中文 bigram / 英文单词) 列表 -> 64 位 SimHash, 按出现次数加权; 特征不足时返回 None"""
+    if len(features) < MIN_FEATURES:
+        return None
+    weights = [0] * BITS
+    for feature, count in Counter(features).items():
+        value = _feature_hash(feature)
+        for bit in range(BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & _MASK).count('1')
+
+
+def bands(value):
+    """指纹的 BANDS 段, 每段 BAND_BITS 位"""
+    return [(value >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1) for band in range(BANDS)]
+
+
+def to_signed(value):
+    """数据库 BIGINT 是有符号的, 存储前转换"""
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & _MASK
+
+
+def group_near_duplicates(values, max_distance):
+    """[(key, 指纹或 None)] -> {key: 代表的 key}
+
+    按顺序分组: 与前面某个代表的海明距离 <= max_distance 的归入距离最近的代表, 否则自己成为代表;
+    返回值不含代表自身和没有指纹的 key。
+    """
+    representatives = []
+    groups = {}
+    for key, value in values:
+        if value is None:
+            continue
+        best = None
+        for rep_key, rep_value in representatives:
+            distance = hamming_distance(value, rep_value)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (rep_key, distance)
+        if best:
+            groups[key] = best[0]
+        else:
+            representatives.append((key, value))
+    return groups
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 标准名称 -> 别名 (代码、英文名、简称); 匹配时忽略大小写和空格
+# 可以通过 TICKER_ALIASES_FILE 指定 JSON 文件 ({"标准名称": ["别名", ...]}) 补充或覆盖
+DEFAULT_ALIASES = {
+    '黄金': ['gold', 'xau', 'xauusd', '金价', '现货黄金', '伦敦金', '沪金', '黄金etf', 'gld'],
+    '白银': ['silver', 'xag', 'xagusd', '银价', '沪银'],
+    '原油': ['crude', 'crude oil', 'oil', 'wti', 'brent', '布油', '美油', '油价'],
+    '铜': ['copper', '沪铜', '铜价'],
+    '比特币': ['btc', 'bitcoin', '大饼'],
+    '以太坊': ['eth', 'ethereum'],
+    '美元指数': ['dxy', '美元', 'usd', 'usdx'],
+    '美债': ['美国国债', 'treasury', 'treasuries', 'tlt', '10年期美债', '美债收益率'],
+    '纳斯达克': ['nasdaq', '纳指', 'ndx', 'qqq', '纳斯达克100', 'ixic'],
+    '标普500': ['s&p500', 's&p 500', 'sp500', 'spx', 'spy', '标普', '标普指数'],
+    '道琼斯': ['dow', 'dji', '道指'],
+    '沪深300': ['hs300', '000300', '沪深300指数'],
+    '上证指数': ['上证', '上证综指', '000001.sh', 'sh000001'],
+    '创业板指': ['创业板', '399006', '创业板指数'],
+    '科创50': ['科创板', '000688'],
+    '恒生指数': ['恒指', 'hsi', '恒生'],
+    '恒生科技': ['恒生科技指数', 'hstech', '恒科'],
+    '宁德时代': ['300750', 'catl', '宁王'],
+    '贵州茅台': ['茅台', '600519', 'moutai'],
+    '比亚迪': ['002594', '01211', 'byd'],
+    '腾讯控股': ['腾讯', '00700', '0700', 'tencent', 'tcehy'],
+    '阿里巴巴': ['阿里', 'baba', '09988', 'alibaba'],
+    '美团': ['03690', 'meituan'],
+    '中国海油': ['中海油', '600938', '00883', 'cnooc'],
+    '长江电力': ['600900', '长电'],
+    '中国平安': ['平安', '601318', '02318'],
+    '招商银行': ['招行', '600036', '03968'],
+    '苹果': ['aapl', 'apple'],
+    '英伟达': ['nvda', 'nvidia'],
+    '特斯拉': ['tsla', 'tesla'],
+    '微软': ['msft', 'microsoft'],
+    '谷歌': ['googl', 'goog', 'google', 'alphabet'],
+    '亚马逊': ['amzn', 'amazon'],
+    'Meta': ['meta', 'fb', 'facebook'],
+}
+
+# 分隔多个标的: 中英文逗号、顿号、分号、斜杠、竖线
+_SPLIT_RE = re.compile(r'[,，、;；/|\n]+')
+_PAREN_RE = re.compile(r'[(（]([^)）]*)[)）]')
+_EXCHANGE_SUFFIX_RE = re.compile(r'^(\d{4,6})\.(sh|sz|hk|bj)$')
+# '无效数据' 是 analyze.py 给验证失败的帖子写入的 ticker
+_EMPTY_VALUES = {'', '无', 'none', 'null', 'n/a', 'na', '-', '暂无', '未提及', '不适用', '无效数据'}
+
+
+def _key(name):
+    return re.sub(r'\s+', '', name or '').lower()
+
+
+class TickerNormalizer:
+    """把 AI 返回的自由文本 ticker 拆分并归一到标准名称"""
+
+    def __init__(self, aliases=None):
+        if aliases is None:
+            aliases = dict(DEFAULT_ALIASES)
+            aliases.update(self._load_file(os.getenv("TICKER_ALIASES_FILE")))
+        self.lookup = {}
+        for canonical, names in aliases.items():
+            self.lookup[_key(canonical)] = canonical
+            for name in names:
+                self.lookup[_key(name)] = canonical
+
+    @staticmethod
+    def _load_file(path):
+        if not path:
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load ticker aliases from {path}: {e}")
+            return {}
+
+    def normalize(self, name):
+        """单个标的名称 -> 标准名称; 不在别名表中时返回去掉括号注释后的原名, 无效值返回 None"""
+        name = (name or '').strip().strip('"\'“”')
+        if _key(name) in _EMPTY_VALUES:
+            return None
+        # "宁德时代 (300750)" 主名称和括号里的代码都尝试匹配
+        candidates = [_PAREN_RE.sub('', name).strip()] + _PAREN_RE.findall(name) + [name]
+        for candidate in candidates:
+            key = _key(candidate)
+            if key in self.lookup:
+                return self.lookup[key]
+            match = _EXCHANGE_SUFFIX_RE.match(key)
+            if match and match.group(1) in self.lookup:
+                return self.lookup[match.group(1)]
+        cleaned = candidates[0] or name
+        return cleaned if _key(cleaned) not in _EMPTY_VALUES else None
+
+    def extract(self, ticker_text, suggestion_text=None):
+        """拆分 ticker 字段, 返回 [(标准名称, 原始名称, 对应的操作建议)], 按标准名称去重
+
+        suggestion 中提到该标的的那一句作为它的建议; 找不到时, 只有一个标的才使用整段 suggestion,
+        多个标的时为 None (避免把别的标的的操作建议算到它头上)。
+        """
+        suggestion_text = (suggestion_text or '').strip()
+        if _key(suggestion_text) in _EMPTY_VALUES:
+            suggestion_text = None
+        clauses = [clause.strip() for clause in re.split(r'[;；。\n]+', suggestion_text or '') if clause.strip()]
+
+        results = []
+        seen = set()
+        for raw in _SPLIT_RE.split(ticker_text or ''):
+            canonical = self.normalize(raw)
+            if not canonical or canonical in seen:
+                continue
+            seen.add(canonical)
+            raw = raw.strip()
+            names = {_key(canonical), _key(_PAREN_RE.sub('', raw))}
+            names.update(_key(alias) for alias, target in self.lookup.items() if target == canonical)
+            names.discard('')
+            suggestion = next((clause for clause in clauses if any(name in _key(clause) for name in names)), None)
+            results.append((canonical, raw, suggestion))
+        if len(results) == 1 and results[0][2] is None:
+            results[0] = (results[0][0], results[0][1], suggestion_text)
+        return results
+
+
+_default = None
+
+
+def default_normalizer():
+    global _default
+    if _default is None:
+        _default = TickerNormalizer()
+    return _default